@@ -0,0 +1,149 @@
+"""
+Benchmark: estado de tarea como dict libre vs TaskRecord, por el camino real.
+
+Mide el costo por actualización (un registro terminado), el de persistirla
+(json.dumps + commit en SQLite: antes en cada cambio, ahora un volcado en
+lote cada TASK_FLUSH_INTERVAL) y el de cada lectura de /status con
+construir_estado_tarea. El "antes" reproduce el dict mutado clave por clave
+con la misma escritura a SQLite y el construir_estado_tarea de entonces;
+el "después" usa TaskStore.registrar_resultado, TaskStore.actualizar y
+main.construir_estado_tarea.
+
+Uso:
+    python benchmarks/bench_task_record.py [iteraciones]
+"""
+import os
+import sys
+import json
+import sqlite3
+import tempfile
+import timeit
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+# main crea sus bases al importarse: apuntarlas a un directorio temporal
+DIRECTORIO = tempfile.mkdtemp(prefix="bench_task_record_")
+os.environ["DATA_DIR"] = DIRECTORIO
+os.chdir(DIRECTORIO)
+
+from task_record import TaskRecord  # noqa: E402
+from task_store import TaskStore  # noqa: E402
+import main  # noqa: E402
+
+
+# === ANTES: dict mutado clave por clave, guardado como JSON ===
+class AlmacenDict:
+    def __init__(self, db_path: str):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE tasks (task_id TEXT PRIMARY KEY, status TEXT, updated_ts REAL, data TEXT)")
+        self.task = {
+            "task_id": "bench", "status": "processing", "progress": 0,
+            "total_records": 10 ** 9, "processed_records": 0, "successful_records": 0,
+            "error_records": 0, "rejected_records": 0, "current_processing": "",
+            "message": "", "result_file_url": None,
+            "created_at": datetime.now().isoformat(),
+            "last_updated": datetime.now().isoformat()
+        }
+
+    def actualizar(self, **campos):
+        self.task.update(campos, last_updated=datetime.now().isoformat())
+        self.conn.execute(
+            "INSERT OR REPLACE INTO tasks (task_id, status, updated_ts, data) VALUES (?, ?, ?, ?)",
+            (self.task["task_id"], self.task["status"], datetime.now().timestamp(),
+             json.dumps(self.task, ensure_ascii=False, default=str))
+        )
+        self.conn.commit()
+
+
+def actualizar_dict(almacen: AlmacenDict):
+    task = almacen.task
+    procesados = task["processed_records"] + 1
+    almacen.actualizar(
+        processed_records=procesados,
+        successful_records=task["successful_records"] + 1,
+        progress=int(procesados / task["total_records"] * 100)
+    )
+
+
+def leer_dict(almacen: AlmacenDict):
+    """construir_estado_tarea tal como era antes de TaskRecord"""
+    task_data = almacen.task
+    task_id = task_data["task_id"]
+    if task_data["total_records"] > 0:
+        success_rate = (task_data["successful_records"] / task_data["processed_records"] * 100) if task_data["processed_records"] > 0 else 0
+        remaining_records = task_data["total_records"] - task_data["processed_records"]
+        estimated_remaining_minutes = remaining_records * 0.5
+    else:
+        success_rate = 0
+        remaining_records = 0
+        estimated_remaining_minutes = 0
+
+    return main.TaskStatus(
+        task_id=task_data["task_id"],
+        status=task_data["status"],
+        progress=task_data["progress"],
+        total_records=task_data["total_records"],
+        processed_records=task_data["processed_records"],
+        successful_records=task_data["successful_records"],
+        error_records=task_data["error_records"],
+        current_processing=task_data["current_processing"],
+        message=task_data["message"],
+        logs=main.registro_logs.recientes(task_id, 10),
+        result_file_url=task_data["result_file_url"],
+        created_at=task_data["created_at"]
+    ).dict(exclude_none=True) | {
+        "success_rate": round(success_rate, 2),
+        "remaining_records": remaining_records,
+        "estimated_remaining_minutes": round(estimated_remaining_minutes, 1),
+        "last_updated": task_data["last_updated"],
+        "partial_results_url": task_data.get("partial_results_url"),
+        "version": main.bus_eventos.version(task_id)
+    }
+
+
+# === DESPUÉS: TaskRecord a través de TaskStore y construir_estado_tarea ===
+# (la respuesta actual incluye además cola, memoria y último checkpoint)
+def crear_store() -> TaskStore:
+    store = TaskStore(os.path.join(DIRECTORIO, "bench_tasks.db"), ttl_seconds=3600)
+    store.crear(TaskRecord("bench", status="processing", total_records=10 ** 9))
+    return store
+
+
+def medir(nombre: str, funcion, iteraciones: int) -> float:
+    segundos = min(timeit.repeat(funcion, number=iteraciones, repeat=5))
+    por_llamada = segundos / iteraciones * 1e6
+    print(f"  {nombre:<42} {por_llamada:9.2f} µs")
+    return por_llamada
+
+
+if __name__ == "__main__":
+    iteraciones = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+
+    almacen = AlmacenDict(os.path.join(DIRECTORIO, "bench_dict.db"))
+    store = crear_store()
+    main.tasks_storage = store
+
+    print("Actualización por registro")
+    medir("dict + INSERT OR REPLACE + commit", lambda: actualizar_dict(almacen), iteraciones)
+    medir("TaskStore.registrar_resultado", lambda: store.registrar_resultado("bench", "EXITOSO"), iteraciones)
+    medir("TaskStore.actualizar(current_processing)", lambda: store.actualizar("bench", current_processing="x"), iteraciones)
+
+    def actualizar_y_volcar():
+        store.registrar_resultado("bench", "EXITOSO")
+        store.volcar()
+
+    print("Persistencia (peor caso: un volcado por cada actualización)")
+    medir("TaskStore.registrar_resultado + volcar", actualizar_y_volcar, iteraciones)
+
+    print("Lectura de estado (/status)")
+    task = store.obtener("bench")
+    medir("dict", lambda: leer_dict(almacen), iteraciones * 10)
+    medir("construir_estado_tarea(TaskRecord)", lambda: main.construir_estado_tarea(task), iteraciones * 10)
+
+    print("Tamaño en memoria")
+    print(f"  {'dict':<42} {sys.getsizeof(almacen.task):6d} bytes")
+    print(f"  {'TaskRecord':<42} {sys.getsizeof(task):6d} bytes")
@@ -0,0 +1,202 @@
+import asyncio
+import multiprocessing
+from typing import Any, Dict, Optional, Tuple
+
+from chrome_reaper import matar_grupo
+
+# Tiempo máximo de respuesta del worker antes de darlo por colgado y reiniciarlo
+TIMEOUT_SETUP = 180
+TIMEOUT_REGISTRO = 300
+TIMEOUT_CIERRE = 30
+
+
+# === PROCESO WORKER ===
+def ejecutar_worker(conexion):
+    """Punto de entrada del proceso worker: atiende llamadas hasta recibir 'close'"""
+    asyncio.run(_atender(conexion))
+
+
+async def _atender(conexion):
+    # Importar Selenium solo en el worker: el proceso de la API no lo necesita
+    from selenium_processor import MarriottProcessor
+
+    processor = None
+    while True:
+        try:
+            metodo, args = conexion.recv()
+        except (EOFError, OSError):
+            break
+
+        try:
+            if metodo == "setup_chrome_driver":
+                if processor is not None:
+                    await processor.close()
+                processor = MarriottProcessor(*args)
+                configurado = await processor.setup_chrome_driver()
+                respuesta: Any = (configurado, processor.ultima_sonda_ms, processor.pid_driver)
+            elif metodo == "procesar_afiliacion":
+                tipo_afiliacion, nombre_afiliador, correos, nombre, correo, reserva = args
+                processor.asignar_tarea(tipo_afiliacion, nombre_afiliador, set(correos))
+                resultado = await processor.procesar_afiliacion(nombre, correo, reserva)
+                respuesta = (resultado, correo in processor.correos_procesados)
+            elif metodo == "limpiar_sesion":
+                respuesta = processor is not None and await processor.limpiar_sesion()
+            elif metodo == "close":
+                if processor is not None:
+                    await processor.close()
+                    processor = None
+                respuesta = True
+            else:
+                raise ValueError(f"Método desconocido: {metodo}")
+            conexion.send((True, respuesta))
+        except Exception as e:
+            conexion.send((False, str(e)))
+
+        if metodo == "close":
+            break
+
+
+# === PROXY EN EL PROCESO DE LA API ===
+class ProcesadorRemoto:
+    """
+    Misma interfaz que MarriottProcessor, pero Chrome vive en un proceso worker.
+    Un Chrome colgado o un pico de memoria no frenan al event loop de la API:
+    si el worker no responde a tiempo o muere, se termina y se vuelve a
+    levantar en la siguiente llamada.
+    """
+
+    def __init__(self, tipo_afiliacion: str, nombre_afiliador: str):
+        self.tipo_afiliacion = tipo_afiliacion.lower()
+        self.nombre_afiliador = nombre_afiliador
+        self.correos_procesados = set()
+        self._proceso: Optional[multiprocessing.Process] = None
+        self._conexion = None
+        self._lock = asyncio.Lock()
+        self._arrancado = False
+        self.reinicios = 0
+        self.ultima_sonda_ms = None
+        self._pid_driver: Optional[int] = None
+
+    def asignar_tarea(self, tipo_afiliacion, nombre_afiliador, correos_procesados):
+        """Reutilizar el navegador para otra tarea (se envía al worker con cada registro)"""
+        self.tipo_afiliacion = tipo_afiliacion.lower()
+        self.nombre_afiliador = nombre_afiliador
+        self.correos_procesados = correos_procesados
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self._proceso.pid if self._proceso is not None else None
+
+    @property
+    def pid_driver(self) -> Optional[int]:
+        """PID (y grupo de procesos) de chromedriver dentro del worker"""
+        return self._pid_driver
+
+    def esta_vivo(self) -> bool:
+        return self._proceso is not None and self._proceso.is_alive()
+
+    # === CICLO DE VIDA DEL WORKER ===
+    def _iniciar_proceso(self):
+        contexto = multiprocessing.get_context("spawn")
+        self._conexion, extremo_worker = contexto.Pipe()
+        self._proceso = contexto.Process(
+            target=ejecutar_worker,
+            args=(extremo_worker,),
+            name="browser-worker",
+            daemon=True
+        )
+        self._proceso.start()
+        extremo_worker.close()
+
+    def _detener_proceso(self):
+        """Terminar el worker (y su Chrome) sin esperar a que responda"""
+        if self._proceso is not None:
+            self._proceso.terminate()
+            self._proceso.join(5)
+            if self._proceso.is_alive():
+                self._proceso.kill()
+                self._proceso.join(5)
+        # chromedriver corre en su propio grupo: no muere con el worker
+        matar_grupo(self._pid_driver)
+        self._pid_driver = None
+        if self._conexion is not None:
+            self._conexion.close()
+        self._proceso = None
+        self._conexion = None
+
+    def _llamar_bloqueante(self, metodo: str, args: Tuple, timeout: float):
+        try:
+            self._conexion.send((metodo, args))
+            respondio = self._conexion.poll(timeout)
+            if respondio:
+                ok, respuesta = self._conexion.recv()
+        except (EOFError, OSError):
+            self._detener_proceso()
+            raise Exception("El worker del navegador terminó inesperadamente")
+
+        if not respondio:
+            self._detener_proceso()
+            raise TimeoutError(f"El worker del navegador no respondió en {timeout:.0f}s ({metodo}); reiniciado")
+
+        if not ok:
+            raise Exception(respuesta)
+        return respuesta
+
+    async def _llamar(self, metodo: str, args: Tuple, timeout: float):
+        async with self._lock:
+            return await asyncio.to_thread(self._llamar_bloqueante, metodo, args, timeout)
+
+    # === INTERFAZ DE MarriottProcessor ===
+    async def setup_chrome_driver(self) -> bool:
+        """Levantar el worker (si hace falta) y configurar Chrome dentro de él"""
+        async with self._lock:
+            if not self.esta_vivo():
+                if self._arrancado:
+                    self.reinicios += 1
+                await asyncio.to_thread(self._detener_proceso)
+                await asyncio.to_thread(self._iniciar_proceso)
+                self._arrancado = True
+            args = (self.tipo_afiliacion, self.nombre_afiliador)
+            configurado, self.ultima_sonda_ms, self._pid_driver = await asyncio.to_thread(
+                self._llamar_bloqueante, "setup_chrome_driver", args, TIMEOUT_SETUP
+            )
+            return configurado
+
+    async def procesar_afiliacion(self, nombre_completo, correo, numero_reserva) -> Dict:
+        if not self.esta_vivo():
+            # El worker se cayó o fue reiniciado: volver a levantarlo antes de seguir
+            if not await self.setup_chrome_driver():
+                return {"success": False, "error": "No se pudo reiniciar el worker del navegador"}
+
+        args = (
+            self.tipo_afiliacion, self.nombre_afiliador, list(self.correos_procesados),
+            nombre_completo, correo, numero_reserva
+        )
+        resultado, procesado = await self._llamar("procesar_afiliacion", args, TIMEOUT_REGISTRO)
+        if procesado:
+            self.correos_procesados.add(correo)
+        return resultado
+
+    async def limpiar_sesion(self) -> bool:
+        """Limpiar cookies y storage del Chrome del worker antes de pasarlo a otra tarea"""
+        self.correos_procesados = set()
+        if not self.esta_vivo():
+            return False
+        try:
+            return await self._llamar("limpiar_sesion", (), TIMEOUT_CIERRE)
+        except Exception as e:
+            print(f"[⚠️] Error limpiando sesión del worker: {e}")
+            return False
+
+    async def reiniciar(self):
+        """Matar el worker aunque esté ocupado; la siguiente llamada levanta uno nuevo"""
+        await asyncio.to_thread(self._detener_proceso)
+
+    async def close(self):
+        """Cerrar Chrome y terminar el worker"""
+        if self.esta_vivo():
+            try:
+                await self._llamar("close", (), TIMEOUT_CIERRE)
+            except Exception as e:
+                print(f"[⚠️] Error cerrando worker del navegador: {e}")
+        await asyncio.to_thread(self._detener_proceso)
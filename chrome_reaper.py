@@ -0,0 +1,97 @@
+import os
+import time
+import signal
+from typing import List, Optional, Set
+
+try:
+    import psutil
+except ImportError:  # Sin psutil solo se matan los grupos de navegadores cerrados (no se buscan huérfanos)
+    psutil = None
+
+# Variable de entorno que heredan chromedriver y Chrome: identifica los procesos
+# lanzados por esta API (valor = PID de la API que los lanzó)
+MARCA_ENTORNO = "MARRIOTT_CHROME_OWNER"
+os.environ.setdefault(MARCA_ENTORNO, str(os.getpid()))
+
+CHROME_REAPER_INTERVAL = float(os.getenv("CHROME_REAPER_INTERVAL", "60"))
+# Edad mínima para tratar como huérfano un grupo sin dueño: un Chrome que
+# todavía está arrancando aún no figura como navegador abierto
+CHROME_REAPER_GRACE = float(os.getenv("CHROME_REAPER_GRACE", "240"))
+
+NOMBRES_CHROME = ("chrome", "chromium")
+
+
+def matar_grupo(pgid: Optional[int], espera: float = 3.0) -> bool:
+    """SIGTERM al grupo de procesos (chromedriver y su Chrome), SIGKILL si no termina; retorna si había procesos"""
+    if not pgid or pgid <= 1 or pgid == os.getpgrp():
+        return False
+    try:
+        os.killpg(pgid, signal.SIGTERM)
+    except ProcessLookupError:
+        _recoger_zombis(pgid)
+        return False
+    except PermissionError:
+        return False
+
+    limite = time.monotonic() + espera
+    while time.monotonic() < limite:
+        _recoger_zombis(pgid)
+        try:
+            os.killpg(pgid, 0)
+        except ProcessLookupError:
+            return True
+        time.sleep(0.1)
+
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    _recoger_zombis(pgid)
+    return True
+
+
+def _recoger_zombis(pgid: int):
+    """waitpid de los hijos propios en el grupo (chromedriver en modo inline) para no dejar zombis"""
+    try:
+        while os.waitpid(-pgid, os.WNOHANG)[0]:
+            pass
+    except ChildProcessError:
+        pass
+
+
+def procesos_marcados() -> List["psutil.Process"]:
+    """Procesos chrome/chromedriver lanzados por esta API o por una instancia anterior que ya no existe"""
+    if psutil is None:
+        return []
+    propios = []
+    for proceso in psutil.process_iter(["name"]):
+        try:
+            nombre = (proceso.info["name"] or "").lower()
+            if not any(parte in nombre for parte in NOMBRES_CHROME):
+                continue
+            duenio = proceso.environ().get(MARCA_ENTORNO)
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            continue
+        if duenio is None:
+            continue
+        if duenio == os.environ[MARCA_ENTORNO] or (duenio.isdigit() and not psutil.pid_exists(int(duenio))):
+            propios.append(proceso)
+    return propios
+
+
+def recoger_huerfanos(en_uso: Set[int], gracia: float = CHROME_REAPER_GRACE) -> int:
+    """
+    Matar los grupos de Chrome marcados que ningún navegador abierto reclama
+    (su tarea terminó, el worker murió o quit() falló); retorna cuántos grupos se mataron
+    """
+    ahora = time.time()
+    huerfanos = set()
+    for proceso in procesos_marcados():
+        try:
+            pgid = os.getpgid(proceso.pid)
+            if pgid in en_uso or ahora - proceso.create_time() < gracia:
+                continue
+        except (ProcessLookupError, psutil.NoSuchProcess):
+            continue
+        huerfanos.add(pgid)
+    return sum(1 for pgid in huerfanos if matar_grupo(pgid))
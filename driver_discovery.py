@@ -0,0 +1,272 @@
+import os
+import re
+import json
+import shutil
+import threading
+import subprocess
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+# Archivo compartido por la API y los workers del navegador
+DRIVER_CACHE_PATH = os.getenv(
+    "DRIVER_CACHE_PATH",
+    os.path.join(os.getenv("DATA_DIR", "data"), "chrome_binaries.json")
+)
+TIMEOUT_VERSION = 15
+
+# === CANDIDATOS ===
+# Rutas específicas de Render/Heroku, variables de entorno y sistema Linux
+CONFIGS_PRODUCCION = [
+    {
+        'name': 'Buildpack Google Chrome',
+        'chrome_bin': '/app/.heroku-buildpack-google-chrome/opt/google/chrome/chrome',
+        'driver_path': '/app/.chromedriver/bin/chromedriver'
+    },
+    {
+        'name': 'Buildpack Chrome Alt',
+        'chrome_bin': '/app/.google-chrome/chrome',
+        'driver_path': '/app/.chromedriver/chromedriver'
+    },
+    {
+        'name': 'Variables Entorno',
+        'chrome_bin': os.getenv('CHROME_BIN', '/usr/bin/google-chrome-stable'),
+        'driver_path': os.getenv('CHROMEDRIVER_PATH', '/usr/local/bin/chromedriver')
+    },
+    {
+        'name': 'Sistema Linux',
+        'chrome_bin': '/usr/bin/google-chrome-stable',
+        'driver_path': '/usr/bin/chromedriver'
+    },
+    {
+        'name': 'Chrome genérico',
+        'chrome_bin': '/usr/bin/google-chrome',
+        'driver_path': '/usr/local/bin/chromedriver'
+    },
+    {
+        'name': 'Chromium respaldo',
+        'chrome_bin': '/usr/bin/chromium-browser',
+        'driver_path': '/usr/bin/chromedriver'
+    }
+]
+
+RUTAS_CHROME = [
+    "/app/.heroku-buildpack-google-chrome/opt/google/chrome/chrome",
+    "/app/.google-chrome/chrome",
+    "/usr/bin/google-chrome-stable",
+    "/usr/bin/google-chrome",
+    "/usr/bin/chromium-browser",
+    "/usr/bin/chromium",
+    "/opt/google/chrome/chrome"
+]
+
+RUTAS_DRIVER = [
+    "/app/.chromedriver/bin/chromedriver",
+    "/app/.chromedriver/chromedriver",
+    "/usr/bin/chromedriver",
+    "/usr/local/bin/chromedriver"
+]
+
+# Pares (chrome_bin, driver_path) que no lograron arrancar Chrome
+Excluidos = FrozenSet[Tuple[Optional[str], str]]
+
+# Resultado ya validado en este proceso
+_binarios: Optional[Dict] = None
+_lock = threading.Lock()
+
+
+def es_produccion() -> bool:
+    is_render = os.getenv('RENDER') or 'render.com' in os.getenv('RENDER_EXTERNAL_URL', '')
+    return bool(is_render or os.getenv('PRODUCTION') or os.getenv('DYNO'))
+
+
+# === VALIDACIÓN ===
+def probar_version(ruta: str) -> Optional[str]:
+    """Ejecutar '<binario> --version'; None si no existe o no responde"""
+    if not ruta or not os.path.isfile(ruta):
+        return None
+    try:
+        resultado = subprocess.run(
+            [ruta, "--version"], capture_output=True, text=True, timeout=TIMEOUT_VERSION
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"[⚠️] {ruta} no respondió a --version: {e}")
+        return None
+    version = resultado.stdout.strip()
+    return version if resultado.returncode == 0 and version else None
+
+
+def version_mayor(version: Optional[str]) -> Optional[int]:
+    """'Google Chrome 120.0.6099.109' / 'ChromeDriver 120.0.6099.109 (...)' -> 120"""
+    coincidencia = re.search(r"(\d+)\.\d+", version or "")
+    return int(coincidencia.group(1)) if coincidencia else None
+
+
+def _huella(rutas: List[str]) -> Dict[str, float]:
+    """mtime de cada binario: si cambia (actualización del buildpack), la cache deja de valer"""
+    return {ruta: os.path.getmtime(ruta) for ruta in rutas if ruta}
+
+
+def _validar(nombre: str, chrome_bin: Optional[str], driver_path: str, excluir: Excluidos = frozenset()) -> Optional[Dict]:
+    if (chrome_bin, driver_path) in excluir:
+        return None
+    driver_version = probar_version(driver_path)
+    if driver_version is None:
+        return None
+    chrome_version = None
+    if chrome_bin:
+        chrome_version = probar_version(chrome_bin)
+        if chrome_version is None:
+            return None
+        # Ambos responden a --version pero ChromeDriver solo maneja su misma versión mayor
+        mayor_chrome, mayor_driver = version_mayor(chrome_version), version_mayor(driver_version)
+        if mayor_chrome and mayor_driver and mayor_chrome != mayor_driver:
+            print(f"[⚠️] {nombre}: Chrome {mayor_chrome} y ChromeDriver {mayor_driver} no son compatibles")
+            return None
+    return {
+        "name": nombre,
+        "chrome_bin": chrome_bin,
+        "driver_path": driver_path,
+        "chrome_version": chrome_version,
+        "driver_version": driver_version,
+        "mtimes": _huella([chrome_bin, driver_path])
+    }
+
+
+# === DESCUBRIMIENTO ===
+def _descubrir_produccion(excluir: Excluidos) -> Optional[Dict]:
+    for config in CONFIGS_PRODUCCION:
+        chrome_bin, driver_path = config['chrome_bin'], config['driver_path']
+        if not (os.path.isfile(chrome_bin) and os.path.isfile(driver_path)):
+            continue
+        if (chrome_bin, driver_path) in excluir:
+            print(f"[⏭️] {config['name']} ya falló al arrancar Chrome, se omite")
+            continue
+
+        print(f"[🔄] Probando {config['name']}...")
+        try:
+            os.chmod(chrome_bin, 0o755)
+            os.chmod(driver_path, 0o755)
+        except Exception as e:
+            print(f"[⚠️] No se pudieron cambiar permisos: {e}")
+
+        binarios = _validar(config['name'], chrome_bin, driver_path)
+        if binarios:
+            return binarios
+        print(f"[⚠️] {config['name']} no pasó la prueba de versión")
+
+    # Combinaciones fuera de la lista anterior
+    print("[🔄] Búsqueda dinámica como último recurso...")
+    chromes = [ruta for ruta in RUTAS_CHROME if probar_version(ruta)]
+    drivers = [ruta for ruta in RUTAS_DRIVER if probar_version(ruta)]
+    for chrome_bin in chromes:
+        for driver_path in drivers:
+            binarios = _validar("Búsqueda dinámica", chrome_bin, driver_path, excluir)
+            if binarios:
+                return binarios
+
+    return _descubrir_webdriver_manager(chromes[0] if chromes else None, excluir)
+
+
+def _descubrir_local(excluir: Excluidos) -> Optional[Dict]:
+    nombres_chrome = ("google-chrome", "google-chrome-stable", "chromium", "chromium-browser")
+    chrome_bin = next((ruta for ruta in map(shutil.which, nombres_chrome) if ruta), None)
+    driver_path = shutil.which("chromedriver")
+    if driver_path:
+        binarios = _validar("Sistema local", chrome_bin, driver_path, excluir)
+        if binarios:
+            return binarios
+    return _descubrir_webdriver_manager(chrome_bin, excluir)
+
+
+def _descubrir_webdriver_manager(chrome_bin: Optional[str], excluir: Excluidos) -> Optional[Dict]:
+    """Descargar ChromeDriver (requiere red); solo si no hay uno instalado que funcione"""
+    try:
+        print("[🔄] Intentando webdriver-manager como respaldo...")
+        from webdriver_manager.chrome import ChromeDriverManager
+        return _validar("webdriver-manager", chrome_bin, ChromeDriverManager().install(), excluir)
+    except Exception as e:
+        print(f"[❌] webdriver-manager falló: {e}")
+        return None
+
+
+# === CACHE ===
+def _leer_cache(produccion: bool) -> Optional[Dict]:
+    try:
+        with open(DRIVER_CACHE_PATH, encoding="utf-8") as f:
+            binarios = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if binarios.get("production") != produccion:
+        return None
+    try:
+        if _huella(list(binarios["mtimes"])) != binarios["mtimes"]:
+            return None
+    except (OSError, KeyError, TypeError):
+        return None
+    return binarios
+
+
+def _escribir_cache(binarios: Dict):
+    directorio = os.path.dirname(DRIVER_CACHE_PATH)
+    try:
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        temporal = f"{DRIVER_CACHE_PATH}.{os.getpid()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(binarios, f, ensure_ascii=False, indent=2)
+        os.replace(temporal, DRIVER_CACHE_PATH)
+    except OSError as e:
+        print(f"[⚠️] No se pudo guardar la cache de binarios: {e}")
+
+
+def obtener_binarios(
+    produccion: Optional[bool] = None,
+    forzar: bool = False,
+    excluir: Excluidos = frozenset()
+) -> Optional[Dict]:
+    """
+    Rutas de Chrome/ChromeDriver ya validadas: memoria del proceso, luego el
+    archivo de cache (válido mientras los mtimes coincidan) y, si no hay
+    acierto, descubrimiento completo con prueba de versión. Con excluir se
+    saltan los pares (chrome_bin, driver_path) que ya fallaron al arrancar.
+    """
+    global _binarios
+    if produccion is None:
+        produccion = es_produccion()
+
+    with _lock:
+        if not forzar:
+            if _binarios is not None and _binarios.get("production") == produccion:
+                return _binarios
+            binarios = _leer_cache(produccion)
+            if binarios is not None:
+                _binarios = binarios
+                return binarios
+
+        print("[🔎] Descubriendo binarios de Chrome/ChromeDriver...")
+        binarios = _descubrir_produccion(excluir) if produccion else _descubrir_local(excluir)
+        if binarios is None:
+            _binarios = None
+            return None
+
+        binarios["production"] = produccion
+        print(f"[📍] {binarios['name']}: {binarios['chrome_bin']} | {binarios['driver_path']} ({binarios['driver_version']})")
+        _escribir_cache(binarios)
+        _binarios = binarios
+        return binarios
+
+
+def binarios_conocidos() -> Optional[Dict]:
+    """Binarios validados en este proceso (sin disparar descubrimiento)"""
+    return _binarios
+
+
+def invalidar_cache():
+    """Olvidar los binarios conocidos (p. ej. Chrome no arrancó con ellos)"""
+    global _binarios
+    with _lock:
+        _binarios = None
+        try:
+            os.remove(DRIVER_CACHE_PATH)
+        except OSError:
+            pass
@@ -0,0 +1,82 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterable
+
+# Dominios de correo aceptados para afiliar (los usa también el lector de
+# Excel en sus workers, por eso viven aquí y no en selenium_processor)
+EXTENSIONES_PERMITIDAS = {
+    'hotmail.com', 'hotmail.es', 'hotmail.mx',
+    'gmail.com', 'gmail.mx',
+    'outlook.com', 'outlook.es', 'outlook.mx',
+    'icloud.com'
+}
+
+# SQLite limita la cantidad de parámetros por consulta
+TAMANO_LOTE_CONSULTA = 500
+
+
+class IndiceCorreos:
+    """
+    Índice persistente (SQLite) de correos ya afiliados y su código.
+    Se comparte entre tareas y sobrevive reinicios del servidor.
+    """
+
+    def __init__(self, db_path: str):
+        directorio = os.path.dirname(db_path)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS correos_afiliados (
+                correo TEXT PRIMARY KEY,
+                codigo TEXT NOT NULL,
+                tipo_afiliacion TEXT,
+                nombre_afiliador TEXT,
+                fecha TEXT
+            )
+        """)
+        self._conn.commit()
+
+    def buscar(self, correos: Iterable[str]) -> Dict[str, Dict]:
+        """Consulta en lote: {correo: {codigo, tipo_afiliacion, nombre_afiliador, fecha}}"""
+        unicos = list(dict.fromkeys(c for c in correos if c))
+        encontrados = {}
+
+        with self._lock:
+            for inicio in range(0, len(unicos), TAMANO_LOTE_CONSULTA):
+                lote = unicos[inicio:inicio + TAMANO_LOTE_CONSULTA]
+                marcadores = ",".join("?" * len(lote))
+                filas = self._conn.execute(
+                    f"SELECT correo, codigo, tipo_afiliacion, nombre_afiliador, fecha "
+                    f"FROM correos_afiliados WHERE correo IN ({marcadores})",
+                    lote
+                ).fetchall()
+                for correo, codigo, tipo, afiliador, fecha in filas:
+                    encontrados[correo] = {
+                        "codigo": codigo,
+                        "tipo_afiliacion": tipo,
+                        "nombre_afiliador": afiliador,
+                        "fecha": fecha
+                    }
+
+        return encontrados
+
+    def registrar(self, correo: str, codigo: str, tipo_afiliacion: str, nombre_afiliador: str):
+        """Guardar (o actualizar) un correo afiliado exitosamente"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO correos_afiliados "
+                "(correo, codigo, tipo_afiliacion, nombre_afiliador, fecha) VALUES (?, ?, ?, ?, ?)",
+                (correo, codigo, tipo_afiliacion, nombre_afiliador, datetime.now().isoformat())
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
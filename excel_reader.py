@@ -0,0 +1,233 @@
+import os
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+from email_index import EXTENSIONES_PERMITIDAS
+
+# === CONFIGURACIÓN ===
+# Posiciones fijas del reporte de llegadas
+FILA_HEADERS = 4   # Fila 4: headers
+FILA_DATOS = 5     # Datos desde la fila 5
+COL_RESERVA = 3    # Columna C
+COL_NOMBRE = 7     # Columna G
+COL_CORREO = 9     # Columna I
+
+# Textos que se consideran celdas vacías
+VALORES_VACIOS = ['', 'nan', 'none']
+
+
+def _normalizar_celda(valor):
+    """Unificar celdas vacías y números enteros entre engines"""
+    if valor is None:
+        return None
+    if isinstance(valor, str) and valor == "":
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    return valor
+
+
+def _iterar_xlsx(file_path: str) -> Iterator[Tuple]:
+    """Iterar filas con openpyxl en modo solo lectura (sin cargar la hoja completa)"""
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+
+        # Fila de headers completa para validar el ancho de la hoja
+        headers = next(ws.iter_rows(min_row=FILA_HEADERS, max_row=FILA_HEADERS, values_only=True), ())
+        yield tuple(headers)
+
+        for fila in ws.iter_rows(min_row=FILA_DATOS, min_col=COL_RESERVA, max_col=COL_CORREO, values_only=True):
+            yield fila
+    finally:
+        wb.close()
+
+
+def _iterar_xls(file_path: str) -> Iterator[Tuple]:
+    """Iterar filas de un .xls antiguo con xlrd (respaldo)"""
+    import xlrd
+
+    book = xlrd.open_workbook(file_path, on_demand=True)
+    try:
+        sheet = book.sheet_by_index(0)
+
+        if sheet.nrows < FILA_HEADERS:
+            yield ()
+            return
+
+        yield tuple(sheet.row_values(FILA_HEADERS - 1))
+
+        for index in range(FILA_DATOS - 1, sheet.nrows):
+            valores = sheet.row_values(index, start_colx=COL_RESERVA - 1, end_colx=COL_CORREO)
+            # xlrd recorta filas cortas: rellenar hasta columna I
+            valores += [None] * (COL_CORREO - COL_RESERVA + 1 - len(valores))
+            yield tuple(valores)
+    finally:
+        book.release_resources()
+
+
+def iterar_filas_excel(file_path: str) -> Iterator[Dict]:
+    """
+    Leer el reporte fila por fila sin construir un DataFrame.
+    Solo se leen las columnas C (reserva), G (nombre) e I (correo) desde la fila 5.
+    Cada registro es {"reserva", "nombre", "correo", "fila"} con los valores crudos.
+    """
+    if not os.path.exists(file_path):
+        raise ValueError("El archivo temporal no existe")
+
+    # Intentar diferentes engines de lectura
+    engines_to_try = [("openpyxl", _iterar_xlsx), ("xlrd", _iterar_xls)]
+
+    filas = None
+    for engine, iterador in engines_to_try:
+        try:
+            filas = iterador(file_path)
+            headers = next(filas)
+            print(f"[DEBUG] Archivo abierto con {engine} (modo streaming)")
+            break
+        except Exception as e:
+            print(f"[DEBUG] Engine {engine} falló: {str(e)}")
+            if engine == engines_to_try[-1][0]:  # Si es el último engine
+                raise
+            continue
+
+    if len(headers) < COL_CORREO:
+        filas.close()
+        raise ValueError("El archivo Excel debe tener al menos 9 columnas (hasta columna I)")
+
+    print("[DEBUG] Headers encontrados:")
+    print(f"  - Columna C (Reserva): '{str(headers[COL_RESERVA - 1]).strip()}'")
+    print(f"  - Columna G (Nombre): '{str(headers[COL_NOMBRE - 1]).strip()}'")
+    print(f"  - Columna I (Correo): '{str(headers[COL_CORREO - 1]).strip()}'")
+
+    filas_leidas = 0
+    for offset, valores in enumerate(filas):
+        filas_leidas += 1
+        yield {
+            "reserva": _normalizar_celda(valores[0]),
+            "nombre": _normalizar_celda(valores[COL_NOMBRE - COL_RESERVA]),
+            "correo": _normalizar_celda(valores[COL_CORREO - COL_RESERVA]),
+            "fila": FILA_DATOS + offset
+        }
+
+    if filas_leidas == 0:
+        raise ValueError("El archivo Excel debe tener al menos 5 filas (incluyendo headers en fila 4)")
+
+
+def _columna_texto(serie: pd.Series) -> pd.Series:
+    """Recortar espacios y convertir 'nan'/'none'/'' en valores nulos"""
+    texto = serie.astype("string").str.strip()
+    return texto.mask(texto.str.lower().isin(VALORES_VACIOS))
+
+
+def validar_registros(columnas: Dict[str, list]) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Validación y normalización por columnas (pandas/NumPy) de todas las filas leídas.
+    Aplica las mismas reglas que MarriottProcessor.es_correo_valido para que
+    los correos que serían rechazados nunca lleguen al navegador.
+    Retorna (registros_validos, rechazados) donde cada rechazo incluye su motivo.
+    """
+    # dtype object: evita que una columna numérica con vacíos pase a float ('123.0')
+    df = pd.DataFrame(columnas, columns=["reserva", "nombre", "correo", "fila"], dtype=object)
+
+    reserva = _columna_texto(df["reserva"])
+    nombre = _columna_texto(df["nombre"])
+    correo = _columna_texto(df["correo"]).str.lower()
+    dominio = correo.str.split("@").str[1]
+
+    # Filas completamente vacías se ignoran sin reportarlas
+    fila_vacia = (reserva.isna() & nombre.isna() & correo.isna()).to_numpy()
+
+    sin_nombre = nombre.isna().to_numpy()
+    formato_invalido = (~correo.str.contains("@", regex=False).fillna(False)).to_numpy(dtype=bool)
+    dominio_invalido = (~dominio.isin(EXTENSIONES_PERMITIDAS)).to_numpy(dtype=bool)
+
+    # Duplicados: solo cuenta la primera aparición entre filas por lo demás válidas
+    candidatos = ~(fila_vacia | sin_nombre | formato_invalido | dominio_invalido)
+    duplicado = np.zeros(len(df), dtype=bool)
+    duplicado[candidatos] = correo[candidatos].duplicated(keep="first").to_numpy()
+
+    motivos = np.select(
+        [fila_vacia, sin_nombre, formato_invalido, dominio_invalido, duplicado],
+        [
+            "",
+            "Nombre vacío",
+            "Correo inválido: Formato inválido",
+            "Correo inválido: Extensión " + dominio.fillna("").astype(str) + " no permitida",
+            "Correo inválido: Correo ya procesado (duplicado)"
+        ],
+        default=None
+    )
+
+    reservas = reserva.fillna("N/A").tolist()
+    nombres = nombre.fillna("").tolist()
+    correos = correo.fillna("").tolist()
+    filas = df["fila"].tolist()
+
+    validos = []
+    rechazados = []
+    for i in range(len(df)):
+        registro = {
+            "reserva": reservas[i],
+            "nombre": nombres[i],
+            "correo": correos[i],
+            "fila": filas[i]
+        }
+        if motivos[i] is None:
+            validos.append(registro)
+        elif not fila_vacia[i]:
+            registro["motivo"] = motivos[i]
+            rechazados.append(registro)
+
+    return validos, rechazados
+
+
+def leer_archivo_excel(file_path: str) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Leer archivo Excel con posiciones exactas conocidas
+    Fila 4: Headers
+    Columna C: No. Rsrv
+    Columna G: Nombre del Huésped
+    Columna I: Correo Electrónico
+    Retorna (registros_validos, rechazados)
+    """
+    try:
+        print(f"[DEBUG] Ruta del archivo: {file_path}")
+        if os.path.exists(file_path):
+            print(f"[DEBUG] Tamaño del archivo: {os.path.getsize(file_path)} bytes")
+
+        # Solo se acumulan las tres columnas necesarias
+        columnas = {"reserva": [], "nombre": [], "correo": [], "fila": []}
+        for fila in iterar_filas_excel(file_path):
+            for clave, valores in columnas.items():
+                valores.append(fila[clave])
+
+        registros, rechazados = validar_registros(columnas)
+
+        for registro in registros[:5]:
+            print(f"[DEBUG] ✅ Registro válido: {registro['nombre']} | {registro['correo']}")
+
+        print(f"[DEBUG] RESUMEN: {len(registros)} registros válidos, "
+              f"{len(rechazados)} rechazados de {len(columnas['fila'])} filas de datos")
+
+        if not registros:
+            raise ValueError("No se encontraron registros válidos")
+
+        return registros, rechazados
+
+    except Exception as e:
+        print(f"[ERROR] Error completo: {str(e)}")
+        raise ValueError(f"Error leyendo archivo Excel: {str(e)}")
+
+
+def anunciar_worker(directorio: str, generacion: int):
+    """Initializer del pool de lectura: informar el PID del worker para poder terminarlo tras un timeout"""
+    anuncio = os.path.join(directorio, f"{generacion}.{os.getpid()}")
+    open(anuncio, "w").close()
+    # El pool se reinició mientras este worker arrancaba: no esperar trabajo que no llegará
+    if os.path.exists(os.path.join(directorio, f"retirado.{generacion}")):
+        os.remove(anuncio)
+        os._exit(0)
@@ -0,0 +1,256 @@
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+
+class ColaLlena(Exception):
+    """La cola de trabajos alcanzó su capacidad máxima"""
+
+
+class TrabajoDuplicado(Exception):
+    """La tarea ya fue admitida y todavía no terminó"""
+
+
+class Trabajo:
+    """Tarea admitida: su corrutina corre desde el inicio, pero el navegador se pide por tandas"""
+
+    __slots__ = ("task_id", "afiliador", "tarea")
+
+    def __init__(self, task_id: str, afiliador: str):
+        self.task_id = task_id
+        self.afiliador = afiliador
+        self.tarea: Optional[asyncio.Task] = None
+
+
+class EstadisticasAfiliador:
+    """Espera acumulada por afiliador para reportar en /queue"""
+
+    __slots__ = ("turnos", "espera_total", "espera_maxima", "ultima_espera")
+
+    def __init__(self):
+        self.turnos = 0
+        self.espera_total = 0.0
+        self.espera_maxima = 0.0
+        self.ultima_espera = 0.0
+
+    def registrar(self, espera: float):
+        self.turnos += 1
+        self.espera_total += espera
+        self.espera_maxima = max(self.espera_maxima, espera)
+        self.ultima_espera = espera
+
+
+class ColaTrabajos:
+    """
+    Planificador de tareas de navegador con reparto justo entre afiliadores.
+    Hay max_concurrentes navegadores (slots); cada tarea los pide por tandas
+    de registros y los turnos se asignan en ronda entre los afiliadores que
+    están esperando, de modo que un reporte chico no queda detrás de uno
+    grande. La concurrencia de navegadores no cambia.
+    """
+
+    def __init__(
+        self,
+        max_concurrentes: int = 1,
+        max_en_cola: int = 20,
+        tamano_tanda: int = 5,
+        al_cambiar: Optional[Callable[[], None]] = None
+    ):
+        self.max_concurrentes = max(1, max_concurrentes)
+        self.max_en_cola = max_en_cola
+        self.tamano_tanda = max(1, tamano_tanda)
+        self._al_cambiar = al_cambiar
+
+        self._trabajos: Dict[str, Trabajo] = {}
+        self._slots_libres: List[int] = list(range(self.max_concurrentes))
+        self._en_turno: Dict[str, int] = {}
+        # Ronda de afiliadores con turnos pendientes y, por afiliador, sus esperas en orden
+        self._ronda: Deque[str] = deque()
+        self._esperas: Dict[str, Deque[Tuple[str, asyncio.Future, float]]] = {}
+        self._estadisticas: Dict[str, EstadisticasAfiliador] = {}
+
+    # === ADMISIÓN ===
+    def llena(self) -> bool:
+        return len(self._trabajos) >= self.max_concurrentes + self.max_en_cola
+
+    def encolar(
+        self,
+        task_id: str,
+        afiliador: str,
+        fabrica: Callable[[], Awaitable]
+    ) -> int:
+        """
+        Admitir una tarea e iniciar su corrutina (que pedirá turnos con turno()).
+        Retorna la posición de espera que tendría ahora (0 si hay un navegador libre)
+        """
+        if task_id in self._trabajos:
+            raise TrabajoDuplicado(f"La tarea {task_id} ya está en la cola")
+        if self.llena():
+            raise ColaLlena(f"Hay {len(self._trabajos)} tareas admitidas; intente más tarde")
+
+        trabajo = Trabajo(task_id, afiliador)
+        self._trabajos[task_id] = trabajo
+        trabajo.tarea = asyncio.create_task(self._ejecutar(trabajo, fabrica))
+
+        if self._slots_libres:
+            return 0
+        return len(self.orden_de_espera()) + 1
+
+    def cancelar(self, task_id: str) -> bool:
+        """Cancelar una tarea admitida que todavía no tiene navegador"""
+        trabajo = self._trabajos.get(task_id)
+        if trabajo is None or task_id in self._en_turno or trabajo.tarea is None:
+            return False
+        trabajo.tarea.cancel()
+        return True
+
+    async def _ejecutar(self, trabajo: Trabajo, fabrica: Callable[[], Awaitable]):
+        try:
+            await fabrica()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"[⚠️] Error en trabajo {trabajo.task_id}: {e}")
+        finally:
+            self._trabajos.pop(trabajo.task_id, None)
+            self._notificar()
+
+    # === TURNOS DE NAVEGADOR ===
+    @asynccontextmanager
+    async def turno(self, task_id: str) -> AsyncIterator[int]:
+        """Esperar un navegador libre (en ronda justa) y retenerlo durante una tanda; entrega el número de slot"""
+        trabajo = self._trabajos[task_id]
+        futuro = asyncio.get_running_loop().create_future()
+
+        esperas = self._esperas.get(trabajo.afiliador)
+        if esperas is None:
+            esperas = self._esperas[trabajo.afiliador] = deque()
+            self._ronda.append(trabajo.afiliador)
+        esperas.append((task_id, futuro, time.monotonic()))
+        self._asignar()
+        if not futuro.done():
+            # Un afiliador nuevo en la ronda puede adelantar a otros
+            self._notificar()
+
+        try:
+            slot = await futuro
+        except asyncio.CancelledError:
+            if futuro.done() and not futuro.cancelled():
+                self._liberar(task_id, futuro.result())
+            else:
+                self._quitar_espera(trabajo.afiliador, task_id)
+            raise
+
+        try:
+            yield slot
+        finally:
+            self._liberar(task_id, slot)
+
+    def _asignar(self):
+        """Dar los slots libres al siguiente afiliador de la ronda"""
+        asignados = False
+        while self._slots_libres and self._ronda:
+            afiliador = self._ronda.popleft()
+            esperas = self._esperas[afiliador]
+            task_id, futuro, desde = esperas.popleft()
+
+            if esperas:
+                self._ronda.append(afiliador)
+            else:
+                del self._esperas[afiliador]
+
+            if futuro.done():
+                continue
+
+            slot = self._slots_libres.pop(0)
+            self._en_turno[task_id] = slot
+            self._estadisticas.setdefault(afiliador, EstadisticasAfiliador()).registrar(time.monotonic() - desde)
+            futuro.set_result(slot)
+            asignados = True
+
+        if asignados:
+            self._notificar()
+
+    def _liberar(self, task_id: str, slot: int):
+        self._en_turno.pop(task_id, None)
+        self._slots_libres.append(slot)
+        self._slots_libres.sort()
+        # Asignar en la siguiente vuelta del loop: así la tarea que suelta el turno
+        # vuelve a la ronda antes del reparto y no se salta a otros afiliadores
+        asyncio.get_running_loop().call_soon(self._asignar)
+
+    def _quitar_espera(self, afiliador: str, task_id: str):
+        esperas = self._esperas.get(afiliador)
+        if esperas is None:
+            return
+        for espera in list(esperas):
+            if espera[0] == task_id:
+                esperas.remove(espera)
+        if not esperas:
+            del self._esperas[afiliador]
+            self._ronda.remove(afiliador)
+        self._notificar()
+
+    def _notificar(self):
+        if self._al_cambiar is not None:
+            try:
+                self._al_cambiar()
+            except Exception as e:
+                print(f"[⚠️] Error notificando cambios de la cola: {e}")
+
+    # === CONSULTA ===
+    def orden_de_espera(self) -> List[str]:
+        """task_id que esperan navegador, en el orden en que recibirán su turno"""
+        colas = {afiliador: list(esperas) for afiliador, esperas in self._esperas.items()}
+        ronda = list(self._ronda)
+        orden = []
+        while ronda:
+            afiliador = ronda.pop(0)
+            task_id, _, _ = colas[afiliador].pop(0)
+            orden.append(task_id)
+            if colas[afiliador]:
+                ronda.append(afiliador)
+        return orden
+
+    def posicion(self, task_id: str) -> Optional[int]:
+        """Posición para el próximo turno (1 = el siguiente); None si no está esperando navegador"""
+        try:
+            return self.orden_de_espera().index(task_id) + 1
+        except ValueError:
+            return None
+
+    def en_espera(self) -> List[str]:
+        return self.orden_de_espera()
+
+    def en_curso(self) -> List[str]:
+        """Tareas que tienen un navegador asignado en este momento"""
+        return list(self._en_turno)
+
+    def slots_en_uso(self) -> List[int]:
+        """Slots de navegador retenidos por una tanda en este momento"""
+        return sorted(self._en_turno.values())
+
+    def admitidas(self) -> List[str]:
+        return list(self._trabajos)
+
+    def por_afiliador(self) -> Dict[str, Dict]:
+        """Profundidad de cola y tiempos de espera por afiliador"""
+        resumen: Dict[str, Dict] = {}
+        for trabajo in self._trabajos.values():
+            datos = resumen.setdefault(trabajo.afiliador, {"tasks": 0, "waiting_turns": 0, "running": 0})
+            datos["tasks"] += 1
+            if trabajo.task_id in self._en_turno:
+                datos["running"] += 1
+        for afiliador, esperas in self._esperas.items():
+            resumen.setdefault(afiliador, {"tasks": 0, "waiting_turns": 0, "running": 0})["waiting_turns"] = len(esperas)
+
+        for afiliador, estadisticas in self._estadisticas.items():
+            resumen.setdefault(afiliador, {"tasks": 0, "waiting_turns": 0, "running": 0}).update({
+                "turns_granted": estadisticas.turnos,
+                "avg_wait_seconds": round(estadisticas.espera_total / estadisticas.turnos, 2),
+                "max_wait_seconds": round(estadisticas.espera_maxima, 2),
+                "last_wait_seconds": round(estadisticas.ultima_espera, 2)
+            })
+        return resumen
@@ -1,18 +1,55 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
 import os
+import sys
+
+# Ejecutado como script: relanzar como "uvicorn main:app". Con el método spawn
+# cada worker (navegador, lectura de Excel) re-ejecuta el script principal;
+# así el script es el de uvicorn y los workers no abren las bases ni arman
+# la app de nuevo
+if __name__ == "__main__":
+    os.execv(sys.executable, [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--host", "0.0.0.0",
+        "--port", os.getenv("PORT", "8000"),
+        "--reload",
+        "--log-level", "info"
+    ])
+
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Query
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 import tempfile
 import asyncio
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 import uuid
 import json
-from typing import Dict, List, Optional
+import hashlib
+import functools
+import multiprocessing
+import signal
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple, Union
 from pydantic import BaseModel
-from openpyxl import load_workbook, Workbook
+import aiofiles
 from selenium_processor import MarriottProcessor
-import uvicorn
-import pandas as pd
+from driver_discovery import binarios_conocidos, obtener_binarios
+from browser_worker import ProcesadorRemoto
+from excel_reader import anunciar_worker, leer_archivo_excel
+from upload_cache import CacheUploads
+from email_index import IndiceCorreos
+from task_store import TaskStore, ESTADOS_ACTIVOS, ESTADOS_FINALES
+from task_record import TaskRecord
+from task_logs import RegistroLogs
+from task_events import BusEventosTareas
+from job_queue import ColaTrabajos, ColaLlena, TrabajoDuplicado
+from memory_watchdog import MonitorMemoria, motivo_reciclaje, rss_arbol
+from chrome_reaper import CHROME_REAPER_GRACE, CHROME_REAPER_INTERVAL, matar_grupo, recoger_huerfanos
+from result_journal import (
+    DiarioResultados, ruta_diario, filas_registradas, exportar_xlsx, CAMPOS_RESULTADO,
+    FORMATOS_EXPORTACION, iterar_csv, iterar_ndjson
+)
 
 # Agregar esta ruta a tu main.py
 
@@ -98,8 +135,8 @@ async def health_check():
                 "version": driver_version
             },
             "directories": {
-                "temp_results": os.path.exists("temp_results"),
-                "logs": os.path.exists("logs")
+                "temp_results": os.path.exists(temp_files_dir),
+                "logs": os.path.exists(logs_dir)
             },
             "message": "Servidor funcionando correctamente" if chrome_found and driver_found else "Chrome/ChromeDriver no encontrado"
         }
@@ -114,7 +151,35 @@ async def health_check():
 # === CONFIGURACIÓN ===
 app = FastAPI(title="Marriott Automation API", version="2.0.0")
 
-# CORS para comunicación con frontend
+# === LÍMITES DE CARGA ===
+MAX_FILE_SIZE_MB = float(os.getenv("MAX_FILE_SIZE_MB", "10"))
+UPLOAD_CHUNK_SIZE = 256 * 1024  # 256 KB por bloque
+# Margen para los encabezados multipart y los campos del formulario
+UPLOAD_MULTIPART_OVERHEAD = 64 * 1024
+RUTAS_UPLOAD = {"/procesar"}
+
+@app.middleware("http")
+async def rechazar_uploads_grandes(request: Request, call_next):
+    """
+    Responder 413 con solo mirar Content-Length, antes de que FastAPI lea y
+    parsee el multipart (sin Content-Length, p. ej. chunked, corta
+    guardar_upload_en_disco al superar el límite)
+    """
+    if request.method == "POST" and request.url.path in RUTAS_UPLOAD:
+        try:
+            declarado = int(request.headers.get("content-length", ""))
+        except ValueError:
+            declarado = None
+        limite_bytes = int(MAX_FILE_SIZE_MB * 1024 * 1024) + UPLOAD_MULTIPART_OVERHEAD
+        if declarado is not None and declarado > limite_bytes:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"El archivo excede el tamaño máximo permitido ({MAX_FILE_SIZE_MB:g} MB)"},
+                headers={"Connection": "close"}
+            )
+    return await call_next(request)
+
+# CORS para comunicación con frontend (registrado al final: envuelve también los 413 tempranos)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # En producción: ["https://tu-frontend.vercel.app"]
@@ -126,7 +191,7 @@ app.add_middleware(
 # === MODELOS DE DATOS ===
 class TaskStatus(BaseModel):
     task_id: str
-    status: str  # "pending", "processing", "completed", "error"
+    status: str  # "pending", "processing", "completed", "error", "interrupted"
     progress: int  # 0-100
     total_records: int
     processed_records: int
@@ -138,375 +203,498 @@ class TaskStatus(BaseModel):
     result_file_url: Optional[str] = None
     created_at: str
 
-# === ALMACENAMIENTO EN MEMORIA DE TAREAS ===
-tasks_storage: Dict[str, Dict] = {}
-temp_files_dir = "temp_results"
+# Resultados y diarios por registro: deben estar en un disco persistente para
+# poder reanudar tareas después de un reinicio (igual que DATA_DIR y LOGS_DIR)
+temp_files_dir = os.getenv("TEMP_DIR", "temp_results")
+
+# Artefactos de descarga ya renderizados (xlsx/csv/ndjson), indexados por ETag
+artifacts_dir = os.path.join(temp_files_dir, "artefactos")
 
 # Crear directorio temporal si no existe
 os.makedirs(temp_files_dir, exist_ok=True)
+os.makedirs(artifacts_dir, exist_ok=True)
 
-# === FUNCIONES AUXILIARES ===
-def leer_archivo_excel(file_path: str) -> List[Dict]:
+# === DATOS PERSISTENTES ===
+data_dir = os.getenv("DATA_DIR", "data")
+os.makedirs(data_dir, exist_ok=True)
+
+# Correos ya afiliados (compartido entre tareas y reinicios)
+indice_correos = IndiceCorreos(os.path.join(data_dir, "correos_afiliados.db"))
+
+# === ALMACENAMIENTO DURABLE DE TAREAS ===
+TASK_TTL_HOURS = float(os.getenv("TASK_TTL_HOURS", "24"))
+TASK_EVICTION_INTERVAL = 600  # Revisar expiración cada 10 minutos
+# Cada cuánto se escribe en SQLite el progreso acumulado de las tareas activas
+TASK_FLUSH_INTERVAL = float(os.getenv("TASK_FLUSH_INTERVAL", "2"))
+tasks_storage = TaskStore(os.path.join(data_dir, "tasks.db"), ttl_seconds=TASK_TTL_HOURS * 3600)
+
+# Logs por tarea: buffer circular en memoria + archivo completo en logs/tareas
+logs_dir = os.getenv("LOGS_DIR", "logs")
+registro_logs = RegistroLogs(
+    os.path.join(logs_dir, "tareas"),
+    tamano_buffer=int(os.getenv("TASK_LOG_BUFFER", "50"))
+)
+
+# Eventos de cambio por tarea para clientes SSE (y versión para ETag / long-poll)
+bus_eventos = BusEventosTareas()
+SSE_HEARTBEAT_SECONDS = 15
+LONG_POLL_MAX_SECONDS = 60
+
+# Identifica este arranque: las versiones de tarea se reinician con el proceso
+BOOT_ID = uuid.uuid4().hex[:8]
+
+# === COLA DE TAREAS DE NAVEGADOR ===
+# MAX_BROWSER_TASKS navegadores compartidos; las tareas los usan por tandas de
+# BROWSER_SLICE_RECORDS registros, en ronda entre afiliadores
+SEGUNDOS_POR_REGISTRO = 30  # Estimación usada para tiempos restantes y de inicio
+
+# Navegadores compartidos: uno por slot de la cola, reutilizados entre tandas y tareas.
+# En modo "process" cada Chrome vive en un proceso worker aparte del de la API
+BROWSER_WORKER_MODE = os.getenv("BROWSER_WORKER_MODE", "process").lower()
+navegadores: Dict[int, Union[MarriottProcessor, ProcesadorRemoto]] = {}
+
+def crear_procesador(tipo_afiliacion: str, nombre_afiliador: str) -> Union[MarriottProcessor, ProcesadorRemoto]:
+    if BROWSER_WORKER_MODE == "inline":
+        return MarriottProcessor(tipo_afiliacion, nombre_afiliador)
+    return ProcesadorRemoto(tipo_afiliacion, nombre_afiliador)
+
+async def configurar_procesador(processor: Union[MarriottProcessor, ProcesadorRemoto]) -> bool:
     """
-    Leer archivo Excel con diagnóstico completo
+    Configurar Chrome; si falla (False, error del worker, timeout o cancelación)
+    cerrar el procesador para no dejar vivo el worker ni un Chrome a medio abrir
     """
     try:
-        import os
-        
-        # === DIAGNÓSTICO COMPLETO ===
-        print(f"[DEBUG] Ruta del archivo: {file_path}")
-        print(f"[DEBUG] ¿Archivo existe? {os.path.exists(file_path)}")
-        
-        if os.path.exists(file_path):
-            file_size = os.path.getsize(file_path)
-            print(f"[DEBUG] Tamaño del archivo: {file_size} bytes")
-            
-            # Leer primeros bytes para verificar formato
-            with open(file_path, 'rb') as f:
-                primeros_bytes = f.read(10)
-                print(f"[DEBUG] Primeros 10 bytes (hex): {primeros_bytes.hex()}")
-                print(f"[DEBUG] Primeros 10 bytes (texto): {primeros_bytes}")
+        if await processor.setup_chrome_driver():
+            return True
+    except BaseException:
+        await processor.close()
+        raise
+    await processor.close()
+    return False
+
+# Sesión tibia: el navegador queda abierto entre tareas y se cierra tras
+# BROWSER_IDLE_TIMEOUT segundos sin uso (0 = cerrarlo al terminar cada tarea)
+BROWSER_WARM_START = os.getenv("BROWSER_WARM_START", "true").lower() in ("1", "true", "yes")
+BROWSER_IDLE_TIMEOUT = float(os.getenv("BROWSER_IDLE_TIMEOUT", "600"))
+navegadores_precalentando: Dict[int, asyncio.Task] = {}
+tarea_por_navegador: Dict[int, str] = {}
+ultimo_uso_navegador: Dict[int, float] = {}
+registros_por_navegador: Dict[int, int] = {}
+
+async def obtener_navegador(
+    slot: int,
+    task_id: str,
+    tipo_afiliacion: str,
+    nombre_afiliador: str,
+    correos_procesados: set
+) -> Union[MarriottProcessor, ProcesadorRemoto]:
+    """Navegador del slot asignado, limpio y configurado para la tarea (se abre si aún no existe)"""
+    precalentando = navegadores_precalentando.get(slot)
+    if precalentando is not None:
+        agregar_log_tarea(task_id, "Esperando navegador precalentado...")
+        await asyncio.shield(precalentando)
+    
+    processor = navegadores.get(slot)
+    anterior = tarea_por_navegador.get(slot)
+    if processor is not None and anterior not in (None, task_id):
+        # Navegador reutilizado: no arrastrar cookies ni storage de otra tarea
+        if not await processor.limpiar_sesion():
+            agregar_log_tarea(task_id, "No se pudo limpiar la sesión del navegador; se abrirá uno nuevo")
+            await cerrar_navegador(slot)
+            processor = None
         else:
-            raise ValueError("El archivo temporal no existe")
-        
-        # Intentar diferentes engines de lectura
-        engines_to_try = ['openpyxl', 'xlrd']
-        
-        for engine in engines_to_try:
-            try:
-                print(f"[DEBUG] Intentando leer con engine: {engine}")
-                
-                # Leer archivo sin asumir headers automáticos
-                df = pd.read_excel(file_path, header=None, engine=engine)
-                
-                print(f"[DEBUG] ¡ÉXITO! Archivo leído con {engine}")
-                print(f"[DEBUG] Dimensiones: {len(df)} filas, {len(df.columns)} columnas")
-                break
-                
-            except Exception as e:
-                print(f"[DEBUG] Engine {engine} falló: {str(e)}")
-                if engine == engines_to_try[-1]:  # Si es el último engine
-                    raise e
-                continue
-        
-        # === RESTO DEL CÓDIGO ORIGINAL ===
-        
-        # Verificar que el archivo tiene suficientes filas y columnas
-        if len(df) <= 4:
-            raise ValueError("El archivo Excel debe tener al menos 5 filas (incluyendo headers en fila 4)")
-        
-        if len(df.columns) < 9:
-            raise ValueError("El archivo Excel debe tener al menos 9 columnas (hasta columna I)")
-        
-        # Verificar headers en fila 4 (índice 3)
-        headers_row = df.iloc[3]
-        print(f"[DEBUG] Headers en fila 4: {headers_row.tolist()}")
-        
-        # Posiciones fijas
-        COL_RESERVA = 2   # Columna C
-        COL_NOMBRE = 6    # Columna G 
-        COL_CORREO = 8    # Columna I
-        
-        # Verificar headers específicos
-        header_reserva = str(headers_row.iloc[COL_RESERVA]).strip()
-        header_nombre = str(headers_row.iloc[COL_NOMBRE]).strip()
-        header_correo = str(headers_row.iloc[COL_CORREO]).strip()
-        
-        print(f"[DEBUG] Headers encontrados:")
-        print(f"  - Columna C (Reserva): '{header_reserva}'")
-        print(f"  - Columna G (Nombre): '{header_nombre}'")
-        print(f"  - Columna I (Correo): '{header_correo}'")
-        
-        # Extraer datos desde fila 5
-        registros = []
-        filas_procesadas = 0
-        filas_validas = 0
-        
-        for index in range(4, min(len(df), 10)):  # Solo primeras 6 filas para debug
-            try:
-                fila = df.iloc[index]
-                filas_procesadas += 1
-                
-                reserva_raw = fila.iloc[COL_RESERVA]
-                nombre_raw = fila.iloc[COL_NOMBRE]
-                correo_raw = fila.iloc[COL_CORREO]
-                
-                print(f"[DEBUG] Fila {index + 1}: '{reserva_raw}' | '{nombre_raw}' | '{correo_raw}'")
-                
-                # Limpiar datos
-                reserva = str(reserva_raw).strip() if pd.notna(reserva_raw) else "N/A"
-                nombre = str(nombre_raw).strip() if pd.notna(nombre_raw) else ""
-                correo = str(correo_raw).strip().lower() if pd.notna(correo_raw) else ""
-                
-                # Validar
-                if not nombre or nombre.lower() in ['nan', 'none', '']:
-                    print(f"[DEBUG] Fila {index + 1} saltada: nombre vacío")
-                    continue
-                    
-                if not correo or correo.lower() in ['nan', 'none', ''] or '@' not in correo:
-                    print(f"[DEBUG] Fila {index + 1} saltada: correo inválido")
-                    continue
-                
-                registros.append({
-                    "reserva": reserva,
-                    "nombre": nombre,
-                    "correo": correo,
-                    "fila": index + 1
-                })
-                filas_validas += 1
-                print(f"[DEBUG] ✅ Registro válido {filas_validas}: {nombre} | {correo}")
-                
-            except Exception as e:
-                print(f"[DEBUG] Error en fila {index + 1}: {e}")
-                continue
-        
-        # Procesar el resto de las filas si las primeras 6 funcionaron
-        if filas_validas > 0 and len(df) > 10:
-            print(f"[DEBUG] Procesando el resto de filas ({len(df) - 10} restantes)...")
-            
-            for index in range(10, len(df)):
-                try:
-                    fila = df.iloc[index]
-                    
-                    reserva_raw = fila.iloc[COL_RESERVA]
-                    nombre_raw = fila.iloc[COL_NOMBRE]
-                    correo_raw = fila.iloc[COL_CORREO]
-                    
-                    reserva = str(reserva_raw).strip() if pd.notna(reserva_raw) else "N/A"
-                    nombre = str(nombre_raw).strip() if pd.notna(nombre_raw) else ""
-                    correo = str(correo_raw).strip().lower() if pd.notna(correo_raw) else ""
-                    
-                    if nombre and nombre.lower() not in ['nan', 'none', ''] and correo and '@' in correo:
-                        registros.append({
-                            "reserva": reserva,
-                            "nombre": nombre,
-                            "correo": correo,
-                            "fila": index + 1
-                        })
-                        filas_validas += 1
-                
-                except Exception as e:
-                    continue
-        
-        print(f"[DEBUG] RESUMEN: {filas_validas} registros válidos de {len(df)} filas totales")
-        
-        if not registros:
-            raise ValueError("No se encontraron registros válidos")
-        
-        return registros
-        
+            agregar_log_tarea(task_id, "Reutilizando navegador abierto (sesión limpia)")
+    
+    if processor is None:
+        processor = crear_procesador(tipo_afiliacion, nombre_afiliador)
+        agregar_log_tarea(task_id, "Configurando navegador...")
+        if not await configurar_procesador(processor):
+            raise Exception("Error configurando ChromeDriver")
+        navegadores[slot] = processor
+        agregar_log_tarea(task_id, f"Navegador configurado correctamente (listo en {processor.ultima_sonda_ms} ms)")
+    elif anterior is None:
+        agregar_log_tarea(task_id, "Usando navegador precalentado")
+    
+    tarea_por_navegador[slot] = task_id
+    ultimo_uso_navegador[slot] = time.monotonic()
+    processor.asignar_tarea(tipo_afiliacion, nombre_afiliador, correos_procesados)
+    return processor
+
+async def cerrar_navegador(slot: int) -> bool:
+    processor = navegadores.pop(slot, None)
+    tarea_por_navegador.pop(slot, None)
+    ultimo_uso_navegador.pop(slot, None)
+    registros_por_navegador.pop(slot, None)
+    if processor is None:
+        return False
+    pgid = processor.pid_driver
+    try:
+        await processor.close()
     except Exception as e:
-        print(f"[ERROR] Error completo: {str(e)}")
-        raise ValueError(f"Error leyendo archivo Excel: {str(e)}")
+        print(f"[⚠️] Error cerrando navegador del slot {slot}: {e}")
+    # Lo que quede del grupo de chromedriver (quit() falló o dejó procesos de Chrome)
+    if await asyncio.to_thread(matar_grupo, pgid):
+        print(f"[🧟] Procesos de Chrome remanentes del slot {slot} eliminados")
+    return True
+
+async def recoger_chrome_huerfanos(gracia: float = CHROME_REAPER_GRACE) -> int:
+    """Matar grupos de Chrome que no pertenecen a ningún navegador abierto"""
+    en_uso = {processor.pid_driver for processor in navegadores.values() if processor.pid_driver}
+    muertos = await asyncio.to_thread(recoger_huerfanos, en_uso, gracia)
+    if muertos:
+        print(f"[🧟] {muertos} grupos de Chrome huérfanos eliminados")
+    return muertos
+
+async def recoger_chrome_huerfanos_periodicamente():
+    while True:
+        await asyncio.sleep(CHROME_REAPER_INTERVAL)
+        try:
+            await recoger_chrome_huerfanos()
+        except Exception as e:
+            print(f"[⚠️] Error recogiendo procesos de Chrome huérfanos: {e}")
+
+async def muestrear_memoria(processor: Union[MarriottProcessor, ProcesadorRemoto], monitor: MonitorMemoria) -> Optional[float]:
+    """RSS actual (MB) del árbol chromedriver/Chrome, sumado a las estadísticas de la tarea"""
+    rss = await asyncio.to_thread(rss_arbol, processor.pid_driver)
+    return monitor.registrar(rss) if rss is not None else None
+
+async def vigilar_navegador(
+    slot: int,
+    task_id: str,
+    processor: Union[MarriottProcessor, ProcesadorRemoto],
+    monitor: MonitorMemoria,
+    tipo_afiliacion: str,
+    nombre_afiliador: str,
+    correos_procesados: set
+) -> Union[MarriottProcessor, ProcesadorRemoto]:
     """
-    Leer archivo Excel con posiciones exactas conocidas
-    Fila 4 (índice 3): Headers
-    Columna C (índice 2): No. Rsrv
-    Columna G (índice 6): Nombre del Huésped  
-    Columna I (índice 8): Correo Electrónico
+    Antes de cada registro: medir la memoria de Chrome y reciclarlo si superó
+    BROWSER_MAX_RSS_MB o ya procesó BROWSER_RECYCLE_EVERY registros
+    """
+    rss_mb = await muestrear_memoria(processor, monitor)
+    motivo = motivo_reciclaje(rss_mb, registros_por_navegador.get(slot, 0))
+    if motivo is None:
+        return processor
+    
+    agregar_log_tarea(task_id, f"♻️ Reciclando navegador ({motivo})")
+    monitor.reciclajes += 1
+    await cerrar_navegador(slot)
+    return await obtener_navegador(slot, task_id, tipo_afiliacion, nombre_afiliador, correos_procesados)
+
+async def cerrar_navegadores_sin_uso(task_id: str):
     """
+    Al terminar una tarea: con BROWSER_IDLE_TIMEOUT los navegadores quedan
+    abiertos para la siguiente; si no, se cierran cuando ninguna otra tarea
+    admitida los va a usar
+    """
+    if BROWSER_IDLE_TIMEOUT > 0:
+        return
+    if any(otra != task_id for otra in cola_trabajos.admitidas()):
+        return
+    for slot in list(navegadores):
+        if await cerrar_navegador(slot):
+            agregar_log_tarea(task_id, "Navegador cerrado")
+
+async def precalentar_navegador(slot: int = 0):
+    """Abrir un navegador antes de que llegue la primera tarea"""
+    if slot in navegadores or slot in navegadores_precalentando:
+        return
+    
+    async def abrir():
+        processor = crear_procesador("express", "")
+        try:
+            if await configurar_procesador(processor):
+                navegadores[slot] = processor
+                ultimo_uso_navegador[slot] = time.monotonic()
+                print(f"[🔥] Navegador precalentado en slot {slot}")
+            else:
+                print("[⚠️] No se pudo precalentar el navegador; se abrirá con la primera tarea")
+        except Exception as e:
+            print(f"[⚠️] Error precalentando navegador: {e}")
+        finally:
+            navegadores_precalentando.pop(slot, None)
+    
+    navegadores_precalentando[slot] = asyncio.create_task(abrir())
+
+async def cerrar_navegadores_inactivos():
+    """Cerrar los navegadores que llevan BROWSER_IDLE_TIMEOUT segundos sin usarse"""
+    intervalo = min(60.0, max(BROWSER_IDLE_TIMEOUT / 2, 1.0))
+    while True:
+        await asyncio.sleep(intervalo)
+        try:
+            ahora = time.monotonic()
+            en_uso = set(cola_trabajos.slots_en_uso())
+            for slot in list(navegadores):
+                if slot in en_uso:
+                    ultimo_uso_navegador[slot] = ahora
+                elif ahora - ultimo_uso_navegador.get(slot, ahora) >= BROWSER_IDLE_TIMEOUT:
+                    await cerrar_navegador(slot)
+                    print(f"[💤] Navegador del slot {slot} cerrado por inactividad")
+        except Exception as e:
+            print(f"[⚠️] Error cerrando navegadores inactivos: {e}")
+
+def notificar_posiciones_cola():
+    """Avisar a las tareas en espera que su posición cambió (SSE / long-poll)"""
+    for posicion, task_id in enumerate(cola_trabajos.en_espera(), start=1):
+        bus_eventos.publicar(task_id, "queue", {"queue_position": posicion})
+
+cola_trabajos = ColaTrabajos(
+    max_concurrentes=int(os.getenv("MAX_BROWSER_TASKS", "1")),
+    max_en_cola=int(os.getenv("MAX_QUEUED_TASKS", "20")),
+    tamano_tanda=int(os.getenv("BROWSER_SLICE_RECORDS", "5")),
+    al_cambiar=notificar_posiciones_cola
+)
+
+def estimar_inicio(posicion: Optional[int]) -> Optional[float]:
+    """Timestamp estimado del próximo turno de navegador para una posición en la cola de espera"""
+    if posicion is None:
+        return None
+    
+    # Cada turno previo (incluidos los que están en curso) ocupa a lo sumo una tanda
+    rondas = -(-posicion // cola_trabajos.max_concurrentes)
+    espera = rondas * cola_trabajos.tamano_tanda * SEGUNDOS_POR_REGISTRO
+    return datetime.now().timestamp() + espera
+
+# === CACHE DE UPLOADS YA LEÍDOS (por hash de contenido) ===
+upload_cache = CacheUploads(
+    os.getenv("UPLOAD_CACHE_DIR", "upload_cache"),
+    max_bytes=int(float(os.getenv("UPLOAD_CACHE_MAX_MB", "50")) * 1024 * 1024)
+)
+
+# Uploads entre el hash y la creación de la tarea: (hash, tipo) -> task_id
+uploads_en_curso: Dict[Tuple[str, str], str] = {}
+
+# === POOL DE PROCESOS PARA LECTURA DE EXCEL ===
+EXCEL_PARSE_WORKERS = int(os.getenv("EXCEL_PARSE_WORKERS", "1"))
+EXCEL_PARSE_TIMEOUT = float(os.getenv("EXCEL_PARSE_TIMEOUT", "60"))
+excel_pool: Optional[ProcessPoolExecutor] = None
+# Cada worker deja un archivo '{generación}.{pid}' al arrancar: tras un timeout se
+# terminan por PID los del pool actual (sin locks compartidos que un worker
+# terminado pueda dejar tomados)
+excel_pool_generacion = 0
+excel_pool_pids_dir = tempfile.mkdtemp(prefix="excel_pool_")
+
+class LecturaInterrumpida(Exception):
+    """La lectura se perdió porque el pool se reinició (timeout de otro archivo o worker caído): reintentable"""
+
+def obtener_pool_excel() -> ProcessPoolExecutor:
+    """Crear (una sola vez) el pool acotado de procesos para leer Excel"""
+    global excel_pool, excel_pool_generacion
+    if excel_pool is None:
+        excel_pool_generacion += 1
+        excel_pool = ProcessPoolExecutor(
+            max_workers=max(1, EXCEL_PARSE_WORKERS),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=anunciar_worker,
+            initargs=(excel_pool_pids_dir, excel_pool_generacion)
+        )
+    return excel_pool
+
+def reiniciar_pool_excel(pool: Optional[ProcessPoolExecutor] = None):
+    """Terminar los procesos del pool (p. ej. tras un timeout) para liberar el worker"""
+    global excel_pool
+    if excel_pool is None or (pool is not None and pool is not excel_pool):
+        return  # Otro lector ya lo reinició
+    pool, excel_pool = excel_pool, None
+    # Primero retirar la generación: un worker que aún arranca ve la marca y sale
+    # solo; uno que ya se anunció aparece en el listado de abajo
+    generacion = str(excel_pool_generacion)
+    open(os.path.join(excel_pool_pids_dir, f"retirado.{generacion}"), "w").close()
+    # ProcessPoolExecutor no permite cancelar una tarea en ejecución: terminar sus
+    # procesos (todos: uno vivo podría quedar esperando un lock del pool muerto)
+    for nombre in os.listdir(excel_pool_pids_dir):
+        generacion_worker, _, pid = nombre.partition(".")
+        if generacion_worker != generacion:
+            continue
+        try:
+            os.kill(int(pid), signal.SIGTERM)
+            os.remove(os.path.join(excel_pool_pids_dir, nombre))
+        except (OSError, ValueError):
+            pass
+    pool.shutdown(wait=False, cancel_futures=True)
+
+async def leer_archivo_excel_async(file_path: str):
+    """Leer Excel en el pool de procesos sin bloquear el event loop"""
+    loop = asyncio.get_running_loop()
+    pool = obtener_pool_excel()
+    future = loop.run_in_executor(pool, leer_archivo_excel, file_path)
     try:
-        # Leer archivo sin asumir headers automáticos
-        df = pd.read_excel(file_path, header=None, engine="openpyxl")
-        
-        print(f"[DEBUG] Archivo Excel leído: {len(df)} filas, {len(df.columns)} columnas")
-        
-        # Verificar que el archivo tiene suficientes filas y columnas
-        if len(df) <= 4:
-            raise ValueError("El archivo Excel debe tener al menos 5 filas (incluyendo headers en fila 4)")
-        
-        if len(df.columns) < 9:  # Necesitamos al menos columna I (índice 8)
-            raise ValueError("El archivo Excel debe tener al menos 9 columnas (hasta columna I)")
-        
-        # Verificar headers en fila 4 (índice 3)
-        headers_row = df.iloc[3]
-        print(f"[DEBUG] Headers en fila 4: {headers_row.tolist()}")
-        
-        # Posiciones fijas basadas en tu información
-        COL_RESERVA = 2   # Columna C (índice 2)
-        COL_NOMBRE = 6    # Columna G (índice 6) 
-        COL_CORREO = 8    # Columna I (índice 8)
-        
-        # Verificar que los headers son los esperados (opcional)
-        header_reserva = str(headers_row.iloc[COL_RESERVA]).strip()
-        header_nombre = str(headers_row.iloc[COL_NOMBRE]).strip()
-        header_correo = str(headers_row.iloc[COL_CORREO]).strip()
-        
-        print(f"[DEBUG] Headers encontrados:")
-        print(f"  - Columna C (Reserva): '{header_reserva}'")
-        print(f"  - Columna G (Nombre): '{header_nombre}'")
-        print(f"  - Columna I (Correo): '{header_correo}'")
-        
-        # Extraer datos desde fila 5 en adelante (índice 4+)
-        registros = []
-        filas_procesadas = 0
-        filas_validas = 0
-        
-        for index in range(4, len(df)):  # Desde fila 5 (índice 4)
-            try:
-                fila = df.iloc[index]
-                filas_procesadas += 1
-                
-                # Extraer valores de las columnas específicas
-                reserva_raw = fila.iloc[COL_RESERVA]
-                nombre_raw = fila.iloc[COL_NOMBRE]
-                correo_raw = fila.iloc[COL_CORREO]
-                
-                # Limpiar y validar datos
-                reserva = str(reserva_raw).strip() if pd.notna(reserva_raw) else "N/A"
-                nombre = str(nombre_raw).strip() if pd.notna(nombre_raw) else ""
-                correo = str(correo_raw).strip().lower() if pd.notna(correo_raw) else ""
-                
-                # Validar que tenemos datos esenciales
-                if not nombre or nombre.lower() in ['nan', 'none', '']:
-                    continue
-                    
-                if not correo or correo.lower() in ['nan', 'none', ''] or '@' not in correo:
-                    continue
-                
-                # Agregar registro válido
-                registros.append({
-                    "reserva": reserva,
-                    "nombre": nombre,
-                    "correo": correo,
-                    "fila": index + 1  # +1 porque Excel empieza en 1
-                })
-                filas_validas += 1
-                
-                # Debug cada 10 registros
-                if filas_validas <= 5 or filas_validas % 10 == 0:
-                    print(f"[DEBUG] Registro {filas_validas}: {nombre} | {correo} | {reserva}")
-                
-            except Exception as e:
-                print(f"[WARNING] Error procesando fila {index + 1}: {e}")
-                continue
-        
-        print(f"[DEBUG] Resumen procesamiento:")
-        print(f"  - Filas procesadas: {filas_procesadas}")
-        print(f"  - Registros válidos: {filas_validas}")
-        
-        if not registros:
-            raise ValueError("No se encontraron registros válidos en el archivo. Verifica que:")
-            raise ValueError("1. La fila 4 contenga los headers")
-            raise ValueError("2. Las columnas C, G, I contengan datos")
-            raise ValueError("3. Hay datos desde la fila 5 en adelante")
-        
-        return registros
-        
-    except Exception as e:
-        print(f"[ERROR] Error completo: {str(e)}")
-        raise ValueError(f"Error leyendo archivo Excel: {str(e)}")
+        return await asyncio.wait_for(future, timeout=EXCEL_PARSE_TIMEOUT)
+    except asyncio.TimeoutError:
+        reiniciar_pool_excel(pool)
+        raise ValueError(f"Tiempo de lectura del archivo excedido ({EXCEL_PARSE_TIMEOUT:.0f}s)")
+    except BrokenProcessPool:
+        # Un timeout de otro archivo terminó los workers o uno murió (p. ej. OOM):
+        # el archivo no tiene la culpa, el cliente puede reintentar
+        reiniciar_pool_excel(pool)
+        raise LecturaInterrumpida("La lectura del archivo se interrumpió por un reinicio del lector; reintente en unos segundos")
+
+# === FUNCIONES AUXILIARES ===
+async def guardar_upload_en_disco(archivo: UploadFile) -> Tuple[str, str, int]:
     """
-    Leer archivo Excel y extraer datos relevantes
+    Copiar el upload a un archivo temporal por bloques (aiofiles), calculando
+    el hash SHA-256 al vuelo y cortando en cuanto se supera MAX_FILE_SIZE_MB.
+    Retorna (ruta, hash, tamaño)
     """
+    limite_bytes = int(MAX_FILE_SIZE_MB * 1024 * 1024)
+    error_tamano = HTTPException(
+        status_code=413,
+        detail=f"El archivo excede el tamaño máximo permitido ({MAX_FILE_SIZE_MB:g} MB)"
+    )
+    
+    # Rechazo temprano si el tamaño ya es conocido
+    if archivo.size is not None and archivo.size > limite_bytes:
+        raise error_tamano
+    
+    fd, tmp_path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    
+    hasher = hashlib.sha256()
+    total_bytes = 0
     try:
-        # Detectar columnas automáticamente
-        col_reserva, col_nombre, col_correo = detectar_columnas_excel(file_path)
-        
-        if not all([col_reserva, col_nombre, col_correo]):
-            missing = []
-            if not col_reserva: missing.append("Número de Reserva")
-            if not col_nombre: missing.append("Nombre del Huésped")
-            if not col_correo: missing.append("Correo Electrónico")
-            raise ValueError(f"No se pudieron encontrar las columnas: {', '.join(missing)}")
-        
-        # Leer archivo completo
-        df = pd.read_excel(file_path)
-        
-        # Extraer solo las filas que tienen datos en las 3 columnas importantes
-        registros = []
-        for index, row in df.iterrows():
-            reserva = row.get(col_reserva)
-            nombre = row.get(col_nombre)
-            correo = row.get(col_correo)
-            
-            # Validar que tenemos datos esenciales
-            if pd.notna(nombre) and pd.notna(correo) and str(nombre).strip() and str(correo).strip():
-                registros.append({
-                    "reserva": str(reserva).strip() if pd.notna(reserva) else "N/A",
-                    "nombre": str(nombre).strip(),
-                    "correo": str(correo).strip().lower(),
-                    "fila": index + 2  # +2 porque Excel empieza en 1 y tenemos header
-                })
-        
-        return registros
-        
-    except Exception as e:
-        raise ValueError(f"Error leyendo archivo Excel: {str(e)}")
+        async with aiofiles.open(tmp_path, 'wb') as tmp_file:
+            while True:
+                bloque = await archivo.read(UPLOAD_CHUNK_SIZE)
+                if not bloque:
+                    break
+                total_bytes += len(bloque)
+                if total_bytes > limite_bytes:
+                    raise error_tamano
+                hasher.update(bloque)
+                await tmp_file.write(bloque)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    
+    return tmp_path, hasher.hexdigest(), total_bytes
 
 def actualizar_estado_tarea(task_id: str, **kwargs):
     """Actualizar el estado de una tarea"""
-    if task_id in tasks_storage:
-        for key, value in kwargs.items():
-            tasks_storage[task_id][key] = value
-        tasks_storage[task_id]["last_updated"] = datetime.now().isoformat()
+    if tasks_storage.actualizar(task_id, **kwargs):
+        bus_eventos.publicar(task_id, "progress", kwargs)
+
+def registrar_resultado_tarea(task_id: str, estado: str, fila: Optional[int] = None):
+    """Sumar un registro terminado a los contadores de la tarea (y avanzar su checkpoint)"""
+    task = tasks_storage.registrar_resultado(task_id, estado, fila)
+    if task is not None:
+        bus_eventos.publicar(task_id, "progress", task.contadores())
 
 def agregar_log_tarea(task_id: str, mensaje: str):
     """Agregar un log a la tarea"""
     if task_id in tasks_storage:
         timestamp = datetime.now().strftime("%H:%M:%S")
         log_con_timestamp = f"[{timestamp}] {mensaje}"
-        tasks_storage[task_id]["logs"].append(log_con_timestamp)
         
-        # Mantener solo los últimos 20 logs para no sobrecargar memoria
-        if len(tasks_storage[task_id]["logs"]) > 20:
-            tasks_storage[task_id]["logs"] = tasks_storage[task_id]["logs"][-20:]
+        # Buffer acotado en memoria; el log completo se vuelca a disco en segundo plano
+        registro_logs.agregar(task_id, log_con_timestamp)
+        bus_eventos.publicar(task_id, "log", {"line": log_con_timestamp})
 
 async def procesar_afiliaciones_background(
     task_id: str, 
     registros: List[Dict], 
     tipo_afiliacion: str, 
-    nombre_afiliador: str
+    nombre_afiliador: str,
+    rechazados: Optional[List[Dict]] = None,
+    reanudar: bool = False
 ):
     """
-    Proceso en segundo plano para automatización secuencial de Marriott
+    Proceso en segundo plano para automatización secuencial de Marriott.
+    Con reanudar=True continúa una tarea interrumpida: los registros que ya
+    tienen resultado en el diario no se vuelven a procesar.
     """
-    processor = None
+    diario = None
+    
+    def fecha_proceso() -> str:
+        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    def anexar_resultado(resultado: Dict):
+        """Guardar el resultado en el diario y avisar a los clientes conectados"""
+        diario.agregar(resultado)
+        bus_eventos.publicar(task_id, "result", {campo: resultado.get(campo) for campo in CAMPOS_RESULTADO})
     
     try:
-        agregar_log_tarea(task_id, f"Iniciando procesamiento de {len(registros)} registros")
-        actualizar_estado_tarea(task_id, status="processing", total_records=len(registros))
-        
-        # Crear procesador
-        processor = MarriottProcessor(tipo_afiliacion, nombre_afiliador)
-        
-        # Configurar navegador
-        agregar_log_tarea(task_id, "Configurando navegador...")
-        if not await processor.setup_chrome_driver():
-            raise Exception("Error configurando ChromeDriver")
-        
-        agregar_log_tarea(task_id, "Navegador configurado correctamente")
+        task = tasks_storage.obtener(task_id)
         
-        # Crear archivo de resultados
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        result_filename = f"afiliaciones_{tipo_afiliacion}_{timestamp}.xlsx"
+        # Archivo de resultados (al reanudar se continúa el mismo)
+        if reanudar and task.result_filename:
+            result_filename = task.result_filename
+        else:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            result_filename = f"afiliaciones_{tipo_afiliacion}_{timestamp}.xlsx"
         result_path = os.path.join(temp_files_dir, result_filename)
+        diario_path = ruta_diario(temp_files_dir, result_filename)
         
-        # Crear Excel de resultados
-        wb_result = Workbook()
-        ws_result = wb_result.active
-        ws_result.title = "Afiliaciones"
+        # Checkpoint: filas que ya tienen resultado en el diario
+        hechas = await asyncio.to_thread(filas_registradas, diario_path) if reanudar else {}
         
-        # Headers del Excel
-        headers = [
-            "No. Fila Original", "No. Reserva", "Nombre Completo", 
-            "Correo", "Código Afiliación", "Afiliador", "Estado", 
-            "Observaciones", "Fecha Proceso"
-        ]
-        ws_result.append(headers)
+        if hechas:
+            agregar_log_tarea(task_id, f"Reanudando procesamiento: {len(hechas)} filas ya tenían resultado")
+        else:
+            agregar_log_tarea(task_id, f"Iniciando procesamiento de {len(registros)} registros")
+        # Sigue "pending" (y cancelable) hasta su primer turno de navegador
+        actualizar_estado_tarea(task_id, total_records=len(registros))
         
-        resultados_exitosos = 0
-        resultados_error = 0
+        # Diario de resultados: cada registro se anexa al terminar (el .xlsx se genera al final)
+        diario = DiarioResultados(diario_path)
+        actualizar_estado_tarea(
+            task_id,
+            result_filename=result_filename,
+            partial_results_url=f"/task/{task_id}/partial"
+        )
         
-        # PROCESAR FILA POR FILA
-        for idx, registro in enumerate(registros):
+        # Filas rechazadas en la validación de carga (nunca llegan al navegador)
+        for rechazo in rechazados or []:
+            if rechazo['fila'] in hechas:
+                continue
+            anexar_resultado({
+                **rechazo,
+                "codigo": "N/A",
+                "afiliador": nombre_afiliador,
+                "estado": "RECHAZADO",
+                "observaciones": rechazo['motivo'],
+                "fecha": fecha_proceso()
+            })
+        
+        # Correos ya afiliados anteriormente: se resuelven desde el índice sin abrir el navegador
+        restantes = [r for r in registros if r['fila'] not in hechas]
+        conocidos = await asyncio.to_thread(indice_correos.buscar, [r['correo'] for r in restantes])
+        pendientes = [r for r in restantes if r['correo'] not in conocidos]
+        
+        for registro in restantes:
+            previo = conocidos.get(registro['correo'])
+            if not previo:
+                continue
+            anexar_resultado({
+                **registro,
+                "codigo": previo['codigo'],
+                "afiliador": nombre_afiliador,
+                "estado": "EXITOSO",
+                "observaciones": f"Ya afiliado previamente ({previo['fecha'][:10]})",
+                "fecha": fecha_proceso()
+            })
+        
+        if conocidos:
+            agregar_log_tarea(task_id, f"{len(restantes) - len(pendientes)} correos ya afiliados resueltos desde el índice")
+        
+        # Contadores desde el diario y el índice (al reanudar reemplazan a los guardados)
+        if conocidos or reanudar:
+            previos = [estado for estado in hechas.values() if estado != "RECHAZADO"]
+            resueltos = len(previos) + len(restantes) - len(pendientes)
+            exitosos = previos.count("EXITOSO") + len(restantes) - len(pendientes)
+            actualizar_estado_tarea(
+                task_id,
+                processed_records=resueltos,
+                successful_records=exitosos,
+                error_records=resueltos - exitosos,
+                progress=resueltos * 100 // len(registros)
+            )
+        
+        async def procesar_registro(processor: Union[MarriottProcessor, ProcesadorRemoto], idx: int, registro: Dict):
+            """Procesar una fila con el navegador asignado y anexar su resultado"""
             try:
                 # Actualizar estado
-                progress = int((idx + 1) / len(registros) * 100)
                 actualizar_estado_tarea(
                     task_id,
-                    processed_records=idx + 1,
-                    progress=progress,
                     current_processing=f"{registro['nombre']} ({registro['correo']})"
                 )
                 
@@ -522,82 +710,92 @@ async def procesar_afiliaciones_background(
                     registro['reserva']
                 )
                 
-                # Preparar datos para Excel
+                # Preparar resultado
                 if resultado['success']:
                     estado = "EXITOSO"
                     codigo = resultado['codigo']
                     observaciones = "Afiliación completada correctamente"
-                    resultados_exitosos += 1
+                    indice_correos.registrar(registro['correo'], codigo, tipo_afiliacion, nombre_afiliador)
                     agregar_log_tarea(task_id, f"✅ ÉXITO: {registro['nombre']} - Código: {codigo}")
                 else:
                     estado = "ERROR"
                     codigo = "N/A"
                     observaciones = resultado['error']
-                    resultados_error += 1
                     agregar_log_tarea(task_id, f"❌ ERROR: {registro['nombre']} - {resultado['error']}")
                 
-                # Agregar fila al Excel
-                fila_resultado = [
-                    registro['fila'],              # Fila original del Excel
-                    registro['reserva'],           # Número de reserva
-                    registro['nombre'],            # Nombre completo
-                    registro['correo'],            # Correo electrónico
-                    codigo,                        # Código de afiliación o N/A
-                    nombre_afiliador,              # Nombre del afiliador
-                    estado,                        # EXITOSO o ERROR
-                    observaciones,                 # Detalles/observaciones
-                    datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # Fecha de proceso
-                ]
-                ws_result.append(fila_resultado)
-                
-                # Guardar progreso cada 5 registros
-                if (idx + 1) % 5 == 0:
-                    wb_result.save(result_path)
-                    agregar_log_tarea(task_id, f"Progreso guardado: {idx + 1}/{len(registros)}")
+                # Anexar resultado al diario
+                anexar_resultado({
+                    **registro,
+                    "codigo": codigo,
+                    "afiliador": nombre_afiliador,
+                    "estado": estado,
+                    "observaciones": observaciones,
+                    "fecha": fecha_proceso()
+                })
+                registrar_resultado_tarea(task_id, estado, registro['fila'])
                 
                 # Pausa entre procesos (importante para no ser detectado)
                 await asyncio.sleep(2)
                 
             except Exception as e:
                 # Error en registro individual
-                resultados_error += 1
                 agregar_log_tarea(task_id, f"🚨 ERROR CRÍTICO: {registro['nombre']} - {str(e)}")
                 
-                # Agregar error al Excel
-                fila_error = [
-                    registro['fila'],
-                    registro['reserva'],
-                    registro['nombre'],
-                    registro['correo'], 
-                    "N/A",
-                    nombre_afiliador,
-                    "ERROR CRÍTICO",
-                    f"Error procesando: {str(e)[:100]}",
-                    datetime.now().strftime("%Y-%m-%d %H:%M%S")
-                ]
-                ws_result.append(fila_error)
-                
-                # Continuar con el siguiente registro
-                continue
-        
-        # Guardar archivo final
-        wb_result.save(result_path)
+                anexar_resultado({
+                    **registro,
+                    "codigo": "N/A",
+                    "afiliador": nombre_afiliador,
+                    "estado": "ERROR CRÍTICO",
+                    "observaciones": f"Error procesando: {str(e)[:100]}",
+                    "fecha": fecha_proceso()
+                })
+                registrar_resultado_tarea(task_id, "ERROR CRÍTICO", registro['fila'])
+        
+        # PROCESAR POR TANDAS: cada tanda retiene un navegador compartido;
+        # los turnos se reparten en ronda entre afiliadores
+        correos_procesados = set()
+        primer_idx = len(registros) - len(pendientes)
+        # Memoria del navegador durante la tarea (continúa lo medido si se reanuda)
+        task = tasks_storage.obtener(task_id)
+        monitor = MonitorMemoria(task.memory_samples, task.memory_avg_mb, task.memory_peak_mb, task.browser_recycles)
+        for inicio in range(0, len(pendientes), cola_trabajos.tamano_tanda):
+            tanda = pendientes[inicio:inicio + cola_trabajos.tamano_tanda]
+            async with cola_trabajos.turno(task_id) as slot:
+                if inicio == 0:
+                    actualizar_estado_tarea(task_id, status="processing", current_processing="Iniciando...")
+                processor = await obtener_navegador(
+                    slot, task_id, tipo_afiliacion, nombre_afiliador, correos_procesados
+                )
+                for idx, registro in enumerate(tanda, start=primer_idx + inicio):
+                    processor = await vigilar_navegador(
+                        slot, task_id, processor, monitor, tipo_afiliacion, nombre_afiliador, correos_procesados
+                    )
+                    await procesar_registro(processor, idx, registro)
+                    registros_por_navegador[slot] = registros_por_navegador.get(slot, 0) + 1
+                await muestrear_memoria(processor, monitor)
+            actualizar_estado_tarea(task_id, **monitor.resumen())
+        
+        # Generar archivo final en una sola pasada
+        diario.close()
+        await asyncio.to_thread(exportar_xlsx, diario.ruta, result_path)
         agregar_log_tarea(task_id, "Archivo Excel de resultados guardado")
         
+        task = tasks_storage.obtener(task_id)
+        mensaje_final = f"✅ Proceso completado exitosamente. Resultados: {task.successful_records} exitosos, {task.error_records} errores"
+        agregar_log_tarea(task_id, mensaje_final)
+        
         # Actualizar estado final
         actualizar_estado_tarea(
             task_id,
             status="completed",
             progress=100,
-            successful_records=resultados_exitosos,
-            error_records=resultados_error,
             result_file_url=f"/download/{result_filename}",
-            current_processing="Proceso completado"
+            current_processing="Proceso completado",
+            message=mensaje_final
         )
         
-        mensaje_final = f"✅ Proceso completado exitosamente. Resultados: {resultados_exitosos} exitosos, {resultados_error} errores"
-        agregar_log_tarea(task_id, mensaje_final)
-        actualizar_estado_tarea(task_id, message=mensaje_final)
+        # Ya no hay nada que reanudar
+        await asyncio.to_thread(tasks_storage.eliminar_entrada, task_id)
         
     except Exception as e:
         # Error crítico del proceso completo
@@ -605,13 +803,18 @@ async def procesar_afiliaciones_background(
         actualizar_estado_tarea(task_id, status="error", message=error_msg)
         
     finally:
-        # Cerrar navegador
-        if processor:
-            try:
-                await processor.close()
-                agregar_log_tarea(task_id, "Navegador cerrado")
-            except Exception:
-                pass
+        if diario:
+            diario.close()
+        
+        # Cerrar navegadores si ninguna otra tarea los necesita
+        await cerrar_navegadores_sin_uso(task_id)
+        try:
+            await recoger_chrome_huerfanos()
+        except Exception as e:
+            print(f"[⚠️] Error recogiendo procesos de Chrome huérfanos: {e}")
+        
+        # Tarea terminada: solo sus últimas líneas quedan en memoria
+        registro_logs.liberar(task_id)
 
 # === ENDPOINTS API ===
 
@@ -623,9 +826,15 @@ async def root():
         "status": "active",
         "endpoints": {
             "POST /procesar": "Iniciar procesamiento de afiliaciones",
-            "GET /status/{task_id}": "Obtener estado de tarea en tiempo real", 
-            "GET /download/{filename}": "Descargar archivo Excel con resultados",
+            "GET /status/{task_id}": "Obtener estado de tarea en tiempo real (ETag, ?wait_for_version=N&timeout=30)", 
+            "GET /status/{task_id}/stream": "Stream SSE con los cambios de la tarea",
+            "GET /download/{filename}?format=xlsx|csv|ndjson": "Descargar resultados en el formato elegido",
+            "GET /task/{task_id}/partial?format=csv|ndjson": "Descargar los resultados parciales de una tarea en curso",
+            "GET /task/{task_id}/logs?offset=&limit=": "Log completo de una tarea, paginado",
+            "POST /task/{task_id}/resume": "Reanudar una tarea interrumpida desde la siguiente fila sin procesar",
             "GET /health": "Health check",
+            "GET /queue": "Turnos de navegador y espera por afiliador",
+            "POST /browser/restart": "Reiniciar los workers de navegador sin reiniciar la API",
             "GET /tasks": "Listar todas las tareas activas"
         },
         "supported_files": [".xlsx", ".xls"],
@@ -635,16 +844,95 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Health check para servicios de despliegue como Render"""
+    conteo_estados = tasks_storage.contar_por_estado()
     return {
         "status": "healthy", 
         "timestamp": datetime.now().isoformat(),
-        "active_tasks": len(tasks_storage),
+        "active_tasks": sum(n for estado, n in conteo_estados.items() if estado in ESTADOS_ACTIVOS),
+        "tasks_by_status": conteo_estados,
+        "running_browser_tasks": len(cola_trabajos.en_curso()),
+        "browser_worker_mode": BROWSER_WORKER_MODE,
+        "browser_workers": estado_workers(),
+        "browser_sessions": estado_sesiones(),
+        "chrome_binaries": resumen_binarios(),
+        "queued_tasks": len(cola_trabajos.en_espera()),
         "temp_files": len([f for f in os.listdir(temp_files_dir) if f.endswith('.xlsx')])
     }
 
+def resumen_binarios() -> Optional[Dict]:
+    """Binarios de Chrome validados al iniciar (None si aún no se descubrieron)"""
+    binarios = binarios_conocidos()
+    if binarios is None:
+        return None
+    return {campo: binarios.get(campo) for campo in ("name", "chrome_bin", "driver_path", "chrome_version", "driver_version")}
+
+def estado_sesiones() -> List[Dict]:
+    """Navegadores abiertos, última tarea que los usó y segundos sin uso"""
+    ahora = time.monotonic()
+    en_uso = set(cola_trabajos.slots_en_uso())
+    return [
+        {
+            "slot": slot,
+            "in_use": slot in en_uso,
+            "last_task_id": tarea_por_navegador.get(slot),
+            "probe_ms": navegadores[slot].ultima_sonda_ms,
+            "process_group": navegadores[slot].pid_driver,
+            "idle_seconds": 0 if slot in en_uso else round(ahora - ultimo_uso_navegador.get(slot, ahora), 1)
+        }
+        for slot in sorted(navegadores)
+    ]
+
+def estado_workers() -> List[Dict]:
+    """Procesos worker de navegador por slot (solo en modo process)"""
+    return [
+        {
+            "slot": slot,
+            "pid": processor.pid,
+            "alive": processor.esta_vivo(),
+            "restarts": processor.reinicios
+        }
+        for slot, processor in sorted(navegadores.items())
+        if isinstance(processor, ProcesadorRemoto)
+    ]
+
+@app.post("/browser/restart")
+async def reiniciar_navegadores():
+    """
+    Reiniciar los workers de navegador sin reiniciar la API.
+    Un registro en curso termina con error y la tarea sigue con un worker nuevo.
+    """
+    if BROWSER_WORKER_MODE == "inline":
+        raise HTTPException(status_code=409, detail="Los navegadores corren dentro de la API (BROWSER_WORKER_MODE=inline)")
+    
+    reiniciados = []
+    for slot, processor in list(navegadores.items()):
+        await processor.reiniciar()
+        reiniciados.append(slot)
+    
+    return {
+        "message": f"{len(reiniciados)} workers de navegador reiniciados",
+        "slots": reiniciados
+    }
+
+@app.get("/queue")
+async def estado_cola():
+    """
+    Estado del planificador de navegadores: turnos en curso, orden de espera
+    y, por afiliador, tareas admitidas, turnos pendientes y tiempos de espera
+    """
+    return {
+        "browser_slots": cola_trabajos.max_concurrentes,
+        "slice_records": cola_trabajos.tamano_tanda,
+        "admitted_tasks": len(cola_trabajos.admitidas()),
+        "max_admitted_tasks": cola_trabajos.max_concurrentes + cola_trabajos.max_en_cola,
+        "running": cola_trabajos.en_curso(),
+        "waiting": cola_trabajos.en_espera(),
+        "by_afiliador": cola_trabajos.por_afiliador(),
+        "server_time": datetime.now().isoformat()
+    }
+
 @app.post("/procesar")
 async def procesar_afiliaciones(
-    background_tasks: BackgroundTasks,
     archivo_excel: UploadFile = File(..., description="Archivo Excel con huéspedes"),
     tipo_afiliacion: str = Form(..., description="Tipo: 'express' o 'junior'"),
     nombre_afiliador: str = Form(..., description="Nombre del afiliador")
@@ -652,6 +940,7 @@ async def procesar_afiliaciones(
     """
     Endpoint principal para iniciar procesamiento de afiliaciones Marriott
     """
+    clave_upload = None
     try:
         # === VALIDACIONES INICIALES ===
         if not archivo_excel.filename.endswith(('.xlsx', '.xls')):
@@ -672,22 +961,58 @@ async def procesar_afiliaciones(
                 detail="nombre_afiliador es requerido y no puede estar vacío"
             )
         
+        # Admisión: no aceptar más trabajo del que la cola puede esperar
+        if cola_trabajos.llena():
+            raise HTTPException(
+                status_code=503,
+                detail="Demasiadas tareas en espera; intente más tarde",
+                headers={"Retry-After": "60"}
+            )
+        
         # === PROCESAR ARCHIVO EXCEL ===
         # Generar ID único para la tarea
         task_id = str(uuid.uuid4())
         
-        # Guardar archivo temporal
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_file:
-            content = await archivo_excel.read()
-            tmp_file.write(content)
-            tmp_path = tmp_file.name
+        # Guardar archivo temporal por bloques
+        tmp_path, file_hash, file_size = await guardar_upload_en_disco(archivo_excel)
+        
+        # ¿El mismo archivo ya se está procesando (o leyendo en otra petición)?
+        clave = (file_hash, tipo_afiliacion.lower())
+        task_existente = uploads_en_curso.get(clave) or tasks_storage.buscar_activa_por_hash(*clave)
+        if task_existente:
+            os.unlink(tmp_path)
+            existente = tasks_storage.obtener(task_existente)
+            return JSONResponse(
+                status_code=200,
+                content={
+                    "success": True,
+                    "duplicate": True,
+                    "message": "Este archivo ya se está procesando",
+                    "task_id": task_existente,
+                    "total_records": existente.total_records if existente else None,
+                    "status_url": f"/status/{task_existente}"
+                }
+            )
+        # Reservar el hash antes del primer await: la tarea recién existe en el
+        # almacén después de leer el Excel
+        uploads_en_curso[clave] = task_id
+        clave_upload = clave
         
-        # Leer y validar Excel
+        # Leer y validar Excel (o reutilizar la lectura previa del mismo archivo)
         try:
-            registros = leer_archivo_excel(tmp_path)
+            cache_hit = await asyncio.to_thread(upload_cache.obtener, file_hash)
+            if cache_hit:
+                registros, rechazados = cache_hit
+                print(f"[DEBUG] Archivo {file_hash[:12]} leído desde cache")
+            else:
+                registros, rechazados = await leer_archivo_excel_async(tmp_path)
+                await asyncio.to_thread(upload_cache.guardar, file_hash, registros, rechazados)
+            
             if not registros:
                 raise ValueError("No se encontraron registros válidos en el archivo Excel")
                 
+        except LecturaInterrumpida as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
         except Exception as e:
             os.unlink(tmp_path)  # Limpiar archivo temporal
             raise HTTPException(status_code=400, detail=str(e))
@@ -696,41 +1021,65 @@ async def procesar_afiliaciones(
             if os.path.exists(tmp_path):
                 os.unlink(tmp_path)
         
-        # === CREAR ESTADO INICIAL DE TAREA ===
-        tasks_storage[task_id] = {
-            "task_id": task_id,
-            "status": "pending",
-            "progress": 0,
-            "total_records": len(registros),
-            "processed_records": 0,
-            "successful_records": 0,
-            "error_records": 0,
-            "current_processing": "Preparando...",
-            "message": f"Tarea creada. {len(registros)} registros para procesar.",
-            "logs": [f"Tarea iniciada con {len(registros)} registros"],
-            "result_file_url": None,
-            "created_at": datetime.now().isoformat(),
-            "last_updated": datetime.now().isoformat(),
-            "tipo_afiliacion": tipo_afiliacion.lower(),
-            "nombre_afiliador": nombre_afiliador.strip()
-        }
+        # La cola pudo llenarse mientras se leía el Excel: comprobarlo de nuevo
+        # antes de crear estado (registro, entrada, log) que habría que deshacer
+        if cola_trabajos.llena():
+            raise HTTPException(
+                status_code=503,
+                detail="Demasiadas tareas en espera; intente más tarde",
+                headers={"Retry-After": "60"}
+            )
         
-        # === INICIAR PROCESAMIENTO EN SEGUNDO PLANO ===
-        background_tasks.add_task(
-            procesar_afiliaciones_background,
+        # === CREAR ESTADO INICIAL DE TAREA ===
+        tasks_storage.crear(TaskRecord(
             task_id,
-            registros,
-            tipo_afiliacion.lower(),
-            nombre_afiliador.strip()
-        )
+            total_records=len(registros),
+            rejected_records=len(rechazados),
+            message=f"Tarea creada. {len(registros)} registros para procesar.",
+            tipo_afiliacion=tipo_afiliacion.lower(),
+            nombre_afiliador=nombre_afiliador.strip(),
+            file_hash=file_hash,
+            file_size=file_size
+        ))
+        # Registros guardados para poder reanudar la tarea si el servidor se reinicia
+        await asyncio.to_thread(tasks_storage.guardar_entrada, task_id, registros, rechazados)
+        agregar_log_tarea(task_id, f"Tarea iniciada con {len(registros)} registros ({len(rechazados)} filas rechazadas en validación)")
+        
+        # === ENCOLAR PROCESAMIENTO EN SEGUNDO PLANO ===
+        try:
+            posicion = cola_trabajos.encolar(
+                task_id,
+                nombre_afiliador.strip(),
+                functools.partial(
+                    procesar_afiliaciones_background,
+                    task_id,
+                    registros,
+                    tipo_afiliacion.lower(),
+                    nombre_afiliador.strip(),
+                    rechazados
+                )
+            )
+        except ColaLlena as e:
+            # Otra petición ocupó el último lugar durante guardar_entrada:
+            # deshacer registro, entrada, log y versión de la tarea
+            tasks_storage.eliminar(task_id)
+            bus_eventos.olvidar(task_id)
+            await asyncio.to_thread(registro_logs.eliminar, task_id)
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "60"})
+        
+        if posicion:
+            actualizar_estado_tarea(task_id, current_processing=f"En cola (posición {posicion})")
         
         return JSONResponse(
             status_code=202,  # Accepted
             content={
                 "success": True,
-                "message": "Procesamiento iniciado exitosamente",
+                "message": "Procesamiento iniciado exitosamente" if not posicion else f"Tarea en cola (posición {posicion})",
                 "task_id": task_id,
                 "total_records": len(registros),
+                "rejected_records": len(rechazados),
+                "rejected_preview": rechazados[:20],
+                "queue_position": posicion,
                 "status_url": f"/status/{task_id}",
                 "estimated_time_minutes": len(registros) * 0.5,  # Estimación: 30 segundos por registro
                 "next_steps": [
@@ -744,110 +1093,503 @@ async def procesar_afiliaciones(
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+    finally:
+        # Creada o descartada, la reserva ya no hace falta (buscar_activa_por_hash cubre la tarea creada)
+        if clave_upload is not None:
+            uploads_en_curso.pop(clave_upload, None)
+
+def construir_estado_tarea(task: TaskRecord) -> Dict:
+    """Payload completo de estado de una tarea (usado por /status y el stream SSE)"""
+    # Estadísticas derivadas de los contadores incrementales del registro
+    remaining_records = task.remaining_records
+    posicion = cola_trabajos.posicion(task.task_id)
+    inicio = estimar_inicio(posicion)
+    
+    # Campos de TaskStatus armados directo: TaskRecord ya tiene los tipos
+    # correctos, validarlos con pydantic en cada consulta solo agrega costo
+    estado = {
+        "task_id": task.task_id,
+        "status": task.status,
+        "progress": task.progress,
+        "total_records": task.total_records,
+        "processed_records": task.processed_records,
+        "successful_records": task.successful_records,
+        "error_records": task.error_records,
+        "current_processing": task.current_processing,
+        "message": task.message,
+        "logs": registro_logs.recientes(task.task_id, 10)  # Solo los últimos 10 logs
+    }
+    if task.result_file_url is not None:
+        estado["result_file_url"] = task.result_file_url
+    
+    return estado | {
+        "created_at": task.created_at,
+        "success_rate": task.success_rate,
+        "remaining_records": remaining_records,
+        "estimated_remaining_minutes": round(remaining_records * SEGUNDOS_POR_REGISTRO / 60, 1),
+        "last_updated": task.last_updated,
+        "partial_results_url": task.partial_results_url,
+        "last_completed_row": task.last_completed_row,
+        "memory_peak_mb": task.memory_peak_mb,
+        "memory_avg_mb": task.memory_avg_mb,
+        "browser_recycles": task.browser_recycles,
+        "queue_position": posicion,
+        "estimated_start_time": datetime.fromtimestamp(inicio).isoformat() if inicio else None,
+        "version": bus_eventos.version(task.task_id)
+    }
+
+def _etag_estado(task_id: str, version: int) -> str:
+    return f'"{task_id}-{BOOT_ID}-{version}"'
 
 @app.get("/status/{task_id}")
-async def obtener_estado(task_id: str):
+async def obtener_estado(
+    task_id: str,
+    request: Request,
+    wait_for_version: Optional[int] = Query(None, ge=0, description="Esperar hasta que la tarea alcance esta versión"),
+    timeout: float = Query(30, ge=0, le=LONG_POLL_MAX_SECONDS, description="Segundos máximos de espera")
+):
     """
-    Obtener estado en tiempo real del procesamiento
+    Obtener estado en tiempo real del procesamiento.
+    Soporta If-None-Match (304 si no hubo cambios) y long-poll con wait_for_version.
     """
     if task_id not in tasks_storage:
         raise HTTPException(status_code=404, detail="Tarea no encontrada")
     
-    task_data = tasks_storage[task_id]
-    
-    # Calcular estadísticas adicionales
-    if task_data["total_records"] > 0:
-        success_rate = (task_data["successful_records"] / task_data["processed_records"] * 100) if task_data["processed_records"] > 0 else 0
-        remaining_records = task_data["total_records"] - task_data["processed_records"]
-        estimated_remaining_minutes = remaining_records * 0.5  # 30 seg por registro
-    else:
-        success_rate = 0
-        remaining_records = 0
-        estimated_remaining_minutes = 0
-    
-    return TaskStatus(
-        task_id=task_data["task_id"],
-        status=task_data["status"],
-        progress=task_data["progress"],
-        total_records=task_data["total_records"],
-        processed_records=task_data["processed_records"],
-        successful_records=task_data["successful_records"],
-        error_records=task_data["error_records"],
-        current_processing=task_data["current_processing"],
-        message=task_data["message"],
-        logs=task_data["logs"][-10:],  # Solo los últimos 10 logs
-        result_file_url=task_data["result_file_url"],
-        created_at=task_data["created_at"]
-    ).dict(exclude_none=True) | {
-        "success_rate": round(success_rate, 2),
-        "remaining_records": remaining_records,
-        "estimated_remaining_minutes": round(estimated_remaining_minutes, 1),
-        "last_updated": task_data["last_updated"]
-    }
+    if wait_for_version is not None:
+        await bus_eventos.esperar_version(task_id, wait_for_version, timeout)
+    
+    task_data = tasks_storage.obtener(task_id)
+    if task_data is None:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    
+    etag = _etag_estado(task_id, bus_eventos.version(task_id))
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    return JSONResponse(
+        content=construir_estado_tarea(task_data),
+        headers={"ETag": etag, "Cache-Control": "no-cache"}
+    )
 
-@app.get("/download/{filename}")
-async def descargar_archivo(filename: str):
+def _evento_sse(tipo: str, datos: Dict, version: Optional[int] = None) -> str:
+    id_linea = f"id: {version}\n" if version is not None else ""
+    return f"{id_linea}event: {tipo}\ndata: {json.dumps(datos, ensure_ascii=False, default=str)}\n\n"
+
+@app.get("/status/{task_id}/stream")
+async def stream_estado(task_id: str, request: Request):
     """
-    Descargar archivo Excel con resultados
+    Stream SSE del estado: un snapshot inicial y luego solo los cambios
+    (progress, log, result) a medida que ocurren. Termina cuando la tarea finaliza.
     """
-    file_path = os.path.join(temp_files_dir, filename)
+    task_data = tasks_storage.obtener(task_id)
+    if task_data is None:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
     
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    async def generar_eventos():
+        # Suscribirse antes del snapshot para no perder cambios intermedios
+        cola = bus_eventos.suscribir(task_id)
+        try:
+            estado = construir_estado_tarea(tasks_storage.obtener(task_id) or task_data)
+            yield _evento_sse("snapshot", estado, estado["version"])
+            if estado["status"] in ESTADOS_FINALES:
+                yield _evento_sse("end", {"status": estado["status"]})
+                return
+            
+            while not await request.is_disconnected():
+                try:
+                    evento = await asyncio.wait_for(cola.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comentario SSE para mantener viva la conexión a través de proxies
+                    yield ": keep-alive\n\n"
+                    continue
+                
+                yield _evento_sse(evento["type"], evento["data"], evento["version"])
+                
+                status = evento["data"].get("status") if evento["type"] == "progress" else None
+                if status in ESTADOS_FINALES:
+                    yield _evento_sse("end", {"status": status})
+                    return
+        finally:
+            bus_eventos.desuscribir(task_id, cola)
+    
+    return StreamingResponse(
+        generar_eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _formato_solicitado(formato: Optional[str], request: Request) -> str:
+    """Formato elegido por el cliente: ?format=, luego header Accept, por defecto xlsx"""
+    if formato:
+        formato = formato.lower()
+        if formato not in FORMATOS_EXPORTACION:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Formato no soportado. Opciones: {', '.join(FORMATOS_EXPORTACION)}"
+            )
+        return formato
+    
+    accept = request.headers.get("accept", "")
+    if "text/csv" in accept:
+        return "csv"
+    if "ndjson" in accept:
+        return "ndjson"
+    return "xlsx"
+
+def _etag_descarga(base_name: str, formato: str, stat: os.stat_result) -> str:
+    """Hash del ETag de una descarga: cambia cuando el diario crece"""
+    return hashlib.sha1(f"{base_name}:{formato}:{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()[:20]
+
+def _claves_artefacto(nombre: str) -> Optional[Tuple[str, str, str]]:
+    """(base_name, etag, formato) de un artefacto '{base}.{etag}.{formato}'; None si no lo es"""
+    partes = nombre.rsplit(".", 2)
+    if len(partes) != 3 or partes[2] not in FORMATOS_EXPORTACION:
+        return None
+    return partes[0], partes[1], partes[2]
+
+def _podar_artefactos(ruta_vigente: str):
+    """Borrar las versiones anteriores (otro ETag) del mismo base_name/formato"""
+    vigente = os.path.basename(ruta_vigente)
+    base_name, _, formato = _claves_artefacto(vigente)
+    for nombre in os.listdir(artifacts_dir):
+        claves = _claves_artefacto(nombre)
+        if nombre != vigente and claves and (claves[0], claves[2]) == (base_name, formato):
+            try:
+                os.remove(os.path.join(artifacts_dir, nombre))
+            except OSError:
+                pass
+
+def podar_artefactos() -> int:
+    """Borrar los artefactos cuyo ETag ya no corresponde al diario actual (o cuyo diario ya no existe)"""
+    borrados = 0
+    for nombre in os.listdir(artifacts_dir):
+        claves = _claves_artefacto(nombre)
+        if claves is None:
+            continue
+        base_name, etag_hash, formato = claves
+        try:
+            stat = os.stat(ruta_diario(temp_files_dir, f"{base_name}.xlsx"))
+            if _etag_descarga(base_name, formato, stat) == etag_hash:
+                continue
+        except OSError:
+            pass
+        try:
+            os.remove(os.path.join(artifacts_dir, nombre))
+            borrados += 1
+        except OSError:
+            pass
+    return borrados
+
+def _render_en_cache(generador, ruta_artefacto: str):
+    """Enviar los bloques al cliente y guardarlos a la vez como artefacto en cache"""
+    tmp_ruta = f"{ruta_artefacto}.{uuid.uuid4().hex}.tmp"
+    completo = False
+    try:
+        with open(tmp_ruta, "wb") as artefacto:
+            for bloque in generador:
+                artefacto.write(bloque)
+                yield bloque
+        completo = True
+        os.replace(tmp_ruta, ruta_artefacto)
+        _podar_artefactos(ruta_artefacto)
+    finally:
+        # Cliente desconectado a mitad: no dejar artefactos incompletos
+        if not completo and os.path.exists(tmp_ruta):
+            os.remove(tmp_ruta)
+
+@app.get("/download/{filename}")
+async def descargar_archivo(
+    filename: str,
+    request: Request,
+    formato: Optional[str] = Query(None, alias="format", description="xlsx, csv o ndjson")
+):
+    """
+    Descargar resultados en xlsx, csv o ndjson (renderizados desde el diario y cacheados por ETag)
+    """
+    if os.path.basename(filename) != filename:
+        raise HTTPException(status_code=400, detail="Nombre de archivo inválido")
     
     if not filename.endswith('.xlsx'):
         raise HTTPException(status_code=400, detail="Solo se pueden descargar archivos Excel")
     
-    return FileResponse(
-        path=file_path,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        filename=filename,
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    formato = _formato_solicitado(formato, request)
+    file_path = os.path.join(temp_files_dir, filename)
+    diario_path = ruta_diario(temp_files_dir, filename)
+    base_name = os.path.splitext(filename)[0]
+    download_name = f"{base_name}.{formato}"
+    
+    # Archivos anteriores al diario: solo existe el .xlsx
+    if not os.path.exists(diario_path):
+        if formato != "xlsx" or not os.path.exists(file_path):
+            raise HTTPException(status_code=404, detail="Archivo no encontrado")
+        return FileResponse(
+            path=file_path,
+            media_type=FORMATOS_EXPORTACION["xlsx"],
+            filename=filename,
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
+    
+    # El ETag cambia cuando el diario crece
+    stat = os.stat(diario_path)
+    etag_hash = _etag_descarga(base_name, formato, stat)
+    etag = f'"{etag_hash}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "Content-Disposition": f"attachment; filename={download_name}"
+    }
+    
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    media_type = FORMATOS_EXPORTACION[formato]
+    
+    # El .xlsx final de la tarea ya está al día si se generó después del último registro
+    if formato == "xlsx" and os.path.exists(file_path) and os.stat(file_path).st_mtime_ns >= stat.st_mtime_ns:
+        return FileResponse(path=file_path, media_type=media_type, headers=headers)
+    
+    artifact_path = os.path.join(artifacts_dir, f"{base_name}.{etag_hash}.{formato}")
+    if os.path.exists(artifact_path):
+        return FileResponse(path=artifact_path, media_type=media_type, headers=headers)
+    
+    if formato == "xlsx":
+        tmp_path = f"{artifact_path}.{uuid.uuid4().hex}.tmp"
+        await asyncio.to_thread(exportar_xlsx, diario_path, tmp_path)
+        os.replace(tmp_path, artifact_path)
+        _podar_artefactos(artifact_path)
+        return FileResponse(path=artifact_path, media_type=media_type, headers=headers)
+    
+    generador = iterar_csv(diario_path) if formato == "csv" else iterar_ndjson(diario_path)
+    return StreamingResponse(
+        _render_en_cache(generador, artifact_path),
+        media_type=media_type,
+        headers=headers
     )
 
+@app.get("/task/{task_id}/partial")
+async def descargar_resultados_parciales(
+    task_id: str,
+    formato: str = Query("ndjson", alias="format", description="csv o ndjson")
+):
+    """
+    Descargar los registros terminados hasta ahora de una tarea (incluso en curso).
+    Lee una instantánea del diario sin tocar el ciclo de procesamiento.
+    """
+    task_data = tasks_storage.obtener(task_id)
+    if task_data is None:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    
+    formato = formato.lower()
+    if formato not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Formato no soportado. Opciones: csv, ndjson")
+    
+    result_filename = task_data.result_filename
+    diario_path = ruta_diario(temp_files_dir, result_filename) if result_filename else None
+    if not diario_path or not os.path.exists(diario_path):
+        raise HTTPException(status_code=404, detail="La tarea aún no tiene resultados")
+    
+    # Instantánea: solo lo escrito hasta este momento
+    hasta_byte = os.path.getsize(diario_path)
+    generador = (iterar_csv if formato == "csv" else iterar_ndjson)(diario_path, hasta_byte)
+    
+    parcial_name = f"{os.path.splitext(result_filename)[0]}_parcial.{formato}"
+    return StreamingResponse(
+        generador,
+        media_type=FORMATOS_EXPORTACION[formato],
+        headers={
+            "Cache-Control": "no-store",
+            "Content-Disposition": f"attachment; filename={parcial_name}",
+            "X-Processed-Records": str(task_data.processed_records)
+        }
+    )
+
+@app.get("/task/{task_id}/logs")
+async def obtener_logs_tarea(
+    task_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """
+    Log completo de una tarea, paginado (desde el archivo de logs/tareas)
+    """
+    if task_id not in tasks_storage:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    
+    lineas, total = await asyncio.to_thread(registro_logs.leer, task_id, offset, limit)
+    siguiente = offset + len(lineas)
+    
+    return {
+        "task_id": task_id,
+        "offset": offset,
+        "limit": limit,
+        "total": total,
+        "logs": lineas,
+        "next_offset": siguiente if siguiente < total else None
+    }
+
+def _parsear_fecha_filtro(valor: Optional[str], nombre: str, fin: bool = False) -> Optional[float]:
+    """Fecha ISO (YYYY-MM-DD o con hora) a timestamp; una fecha sola como 'hasta' incluye todo el día"""
+    if not valor:
+        return None
+    try:
+        fecha = datetime.fromisoformat(valor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Fecha inválida en '{nombre}': use formato YYYY-MM-DD")
+    if fin and len(valor) == 10:
+        fecha += timedelta(days=1)
+    return fecha.timestamp()
+
 @app.get("/tasks")
-async def listar_tareas():
+async def listar_tareas(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    tipo_afiliacion: Optional[str] = None,
+    nombre_afiliador: Optional[str] = None,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None
+):
     """
-    Listar todas las tareas activas (útil para debugging y monitoreo)
+    Listar tareas por página, más recientes primero (útil para debugging y monitoreo).
+    Filtros opcionales por estado, tipo, afiliador y rango de fechas de creación;
+    use next_cursor para pedir la página siguiente.
     """
+    try:
+        tareas, next_cursor = tasks_storage.listar(
+            limite=limit,
+            cursor=cursor,
+            status=status,
+            tipo_afiliacion=tipo_afiliacion,
+            nombre_afiliador=nombre_afiliador,
+            desde=_parsear_fecha_filtro(desde, "desde"),
+            hasta=_parsear_fecha_filtro(hasta, "hasta", fin=True)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     tasks_summary = []
     
-    for task_id, task_data in tasks_storage.items():
+    for task_data in tareas:
         tasks_summary.append({
-            "task_id": task_id,
-            "status": task_data["status"],
-            "progress": task_data["progress"],
-            "total_records": task_data["total_records"],
-            "processed_records": task_data["processed_records"],
-            "successful_records": task_data["successful_records"],
-            "created_at": task_data["created_at"],
-            "tipo_afiliacion": task_data.get("tipo_afiliacion", "unknown"),
-            "nombre_afiliador": task_data.get("nombre_afiliador", "unknown")
+            "task_id": task_data.task_id,
+            "status": task_data.status,
+            "progress": task_data.progress,
+            "total_records": task_data.total_records,
+            "processed_records": task_data.processed_records,
+            "successful_records": task_data.successful_records,
+            "created_at": task_data.created_at,
+            "tipo_afiliacion": task_data.tipo_afiliacion or "unknown",
+            "nombre_afiliador": task_data.nombre_afiliador or "unknown"
         })
     
+    por_estado = tasks_storage.contar_por_estado()
+    
     return {
-        "total_active_tasks": len(tasks_storage),
+        "total_active_tasks": sum(por_estado.get(estado, 0) for estado in ESTADOS_ACTIVOS),
+        "count": len(tasks_summary),
         "tasks": tasks_summary,
+        "next_cursor": next_cursor,
         "server_time": datetime.now().isoformat()
     }
 
+@app.post("/task/{task_id}/resume")
+async def reanudar_tarea(task_id: str):
+    """
+    Reanudar una tarea interrumpida (reinicio del servidor) o con error crítico.
+    Continúa desde la siguiente fila sin resultado en el diario.
+    """
+    task_data = tasks_storage.obtener(task_id)
+    if task_data is None:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    
+    if task_data.status not in ("interrupted", "error"):
+        raise HTTPException(
+            status_code=409,
+            detail=f"Solo se pueden reanudar tareas interrumpidas (estado actual: {task_data.status})"
+        )
+    
+    if cola_trabajos.llena():
+        raise HTTPException(
+            status_code=503,
+            detail="Demasiadas tareas en espera; intente más tarde",
+            headers={"Retry-After": "60"}
+        )
+    
+    # Pasar a "pending" antes de cualquier await: un segundo resume concurrente
+    # ya no pasa la verificación de estado
+    estado_anterior = task_data.status
+    mensaje_anterior = task_data.message
+    actualizar_estado_tarea(
+        task_id,
+        status="pending",
+        current_processing="Reanudando...",
+        message="Tarea reanudada"
+    )
+    
+    try:
+        entrada = await asyncio.to_thread(tasks_storage.obtener_entrada, task_id)
+        if entrada is None:
+            raise HTTPException(status_code=409, detail="La tarea no tiene registros guardados para reanudar")
+        registros, rechazados = entrada
+        
+        posicion = cola_trabajos.encolar(
+            task_id,
+            task_data.nombre_afiliador,
+            functools.partial(
+                procesar_afiliaciones_background,
+                task_id,
+                registros,
+                task_data.tipo_afiliacion,
+                task_data.nombre_afiliador,
+                rechazados,
+                True
+            )
+        )
+    except (HTTPException, ColaLlena, TrabajoDuplicado) as e:
+        actualizar_estado_tarea(task_id, status=estado_anterior, message=mensaje_anterior)
+        if isinstance(e, HTTPException):
+            raise
+        if isinstance(e, TrabajoDuplicado):
+            raise HTTPException(status_code=409, detail=str(e))
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "60"})
+    if posicion:
+        actualizar_estado_tarea(task_id, current_processing=f"En cola (posición {posicion})")
+    
+    return JSONResponse(
+        status_code=202,
+        content={
+            "success": True,
+            "message": "Tarea reanudada",
+            "task_id": task_id,
+            "total_records": len(registros),
+            "last_completed_row": task_data.last_completed_row,
+            "queue_position": posicion,
+            "status_url": f"/status/{task_id}"
+        }
+    )
+
 @app.delete("/task/{task_id}")
 async def eliminar_tarea(task_id: str):
     """
     Eliminar una tarea específica (limpieza manual)
     """
-    if task_id not in tasks_storage:
+    task_data = tasks_storage.obtener(task_id)
+    if task_data is None:
         raise HTTPException(status_code=404, detail="Tarea no encontrada")
     
-    task_status = tasks_storage[task_id]["status"]
+    task_status = task_data.status
     
-    if task_status == "processing":
+    # Una tarea en cola se cancela; si ya obtuvo navegador, está en procesamiento
+    en_cola = task_id in cola_trabajos.admitidas()
+    if task_status == "processing" or (en_cola and not cola_trabajos.cancelar(task_id)):
         raise HTTPException(
             status_code=400, 
             detail="No se puede eliminar una tarea en procesamiento"
         )
     
-    del tasks_storage[task_id]
+    tasks_storage.eliminar(task_id)
+    bus_eventos.olvidar(task_id)
+    await asyncio.to_thread(registro_logs.eliminar, task_id)
     
     return {
         "message": f"Tarea {task_id} eliminada exitosamente",
@@ -855,12 +1597,39 @@ async def eliminar_tarea(task_id: str):
     }
 
 # === EVENTOS DE APLICACIÓN ===
+async def expirar_tareas_periodicamente():
+    """Eliminar del almacén las tareas terminadas que superan TASK_TTL_HOURS (y artefactos obsoletos)"""
+    while True:
+        try:
+            eliminadas = await asyncio.to_thread(tasks_storage.expirar)
+            for task_id in eliminadas:
+                bus_eventos.olvidar(task_id)
+                await asyncio.to_thread(registro_logs.eliminar, task_id)
+            if eliminadas:
+                print(f"[🧹] {len(eliminadas)} tareas expiradas eliminadas")
+            artefactos = await asyncio.to_thread(podar_artefactos)
+            if artefactos:
+                print(f"[🧹] {artefactos} artefactos de descarga obsoletos eliminados")
+        except Exception as e:
+            print(f"[⚠️] Error expirando tareas: {e}")
+        await asyncio.sleep(TASK_EVICTION_INTERVAL)
+
+async def volcar_progreso_periodicamente():
+    """Persistir en lote el progreso de las tareas activas (contadores, registro actual, memoria)"""
+    while True:
+        await asyncio.sleep(TASK_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(tasks_storage.volcar)
+        except Exception as e:
+            print(f"[⚠️] Error guardando el progreso de las tareas: {e}")
+
 @app.on_event("startup")
 async def startup_event():
     """
     Ejecutar al iniciar la aplicación
     """
     print("=== MARRIOTT AUTOMATION API INICIADA ===")
+    bus_eventos.vincular_loop(asyncio.get_running_loop())
     print(f"Directorio temporal: {temp_files_dir}")
     
     # Limpiar archivos antiguos (más de 24 horas)
@@ -868,19 +1637,48 @@ async def startup_event():
         current_time = datetime.now().timestamp()
         files_cleaned = 0
         
-        for filename in os.listdir(temp_files_dir):
-            file_path = os.path.join(temp_files_dir, filename)
-            if os.path.getmtime(file_path) < current_time - 86400:  # 24 horas
-                os.remove(file_path)
-                files_cleaned += 1
+        for directorio in (temp_files_dir, artifacts_dir):
+            for filename in os.listdir(directorio):
+                file_path = os.path.join(directorio, filename)
+                if os.path.isfile(file_path) and os.path.getmtime(file_path) < current_time - 86400:  # 24 horas
+                    os.remove(file_path)
+                    files_cleaned += 1
         
         print(f"Limpieza inicial: {files_cleaned} archivos antiguos eliminados")
         
     except Exception as e:
         print(f"Error en limpieza inicial: {e}")
     
+    # Tareas que quedaron a medias por un reinicio
+    interrumpidas = tasks_storage.marcar_interrumpidas(
+        "🚨 Tarea interrumpida por reinicio del servidor. Use POST /task/{task_id}/resume para continuar"
+    )
+    if interrumpidas:
+        print(f"Tareas interrumpidas por reinicio (reanudables): {len(interrumpidas)}")
+    
+    asyncio.create_task(expirar_tareas_periodicamente())
+    asyncio.create_task(volcar_progreso_periodicamente())
+    asyncio.create_task(descubrir_binarios_chrome())
+    if BROWSER_IDLE_TIMEOUT > 0:
+        asyncio.create_task(cerrar_navegadores_inactivos())
+    asyncio.create_task(recoger_chrome_huerfanos_periodicamente())
+    
     print("API lista para recibir peticiones")
 
+async def descubrir_binarios_chrome():
+    """Validar Chrome/ChromeDriver una vez al iniciar (los workers leen la cache resultante) y precalentar el navegador"""
+    try:
+        binarios = await asyncio.to_thread(obtener_binarios)
+        if binarios is None:
+            print("[⚠️] No se encontraron binarios de Chrome/ChromeDriver; se reintentará al abrir el navegador")
+            return
+    except Exception as e:
+        print(f"[⚠️] Error descubriendo binarios de Chrome: {e}")
+        return
+    
+    if BROWSER_WARM_START:
+        await precalentar_navegador()
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """
@@ -888,18 +1686,27 @@ async def shutdown_event():
     """
     print("=== CERRANDO MARRIOTT AUTOMATION API ===")
     
-    # Aquí podrías agregar lógica para cerrar navegadores activos
-    # y limpiar recursos si fuera necesario
+    if excel_pool is not None:
+        excel_pool.shutdown(wait=False, cancel_futures=True)
+    shutil.rmtree(excel_pool_pids_dir, ignore_errors=True)
+    
+    # Cerrar navegadores (y sus workers) abiertos, incluido uno que se esté precalentando
+    for precalentando in list(navegadores_precalentando.values()):
+        try:
+            await asyncio.wait_for(asyncio.shield(precalentando), timeout=30)
+        except Exception:
+            pass
+    for slot in list(navegadores):
+        await cerrar_navegador(slot)
+    
+    # Cualquier Chrome lanzado por esta API que haya quedado vivo
+    try:
+        await recoger_chrome_huerfanos(gracia=0)
+    except Exception as e:
+        print(f"[⚠️] Error recogiendo procesos de Chrome huérfanos: {e}")
+    
+    # Volcar el progreso y los logs pendientes a disco
+    tasks_storage.volcar()
+    registro_logs.cerrar()
     
     print("API cerrada correctamente")
-
-# === CONFIGURACIÓN PARA PRODUCCIÓN ===
-if __name__ == "__main__":
-    # Para desarrollo local
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=int(os.getenv("PORT", 8000)),
-        reload=True,
-        log_level="info"
-    )
\ No newline at end of file
@@ -0,0 +1,102 @@
+import os
+from typing import Dict, Optional
+
+try:
+    import psutil
+except ImportError:  # Sin psutil el watchdog solo recicla por cantidad de registros
+    psutil = None
+
+MB = 1024 * 1024
+
+# Archivos con el límite de memoria del contenedor (cgroup v2 y v1)
+RUTAS_LIMITE_CGROUP = ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes")
+# Parte del límite del contenedor que puede usar Chrome: el resto es de la API,
+# el worker del navegador y el lector de Excel
+FRACCION_CONTENEDOR = 0.6
+
+
+def limite_contenedor_mb() -> Optional[float]:
+    """Límite de memoria del cgroup en MB; None si no hay límite o no se puede leer"""
+    for ruta in RUTAS_LIMITE_CGROUP:
+        try:
+            with open(ruta) as f:
+                valor = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v2 sin límite escribe "max"; v1 un número cercano a 2^63
+        if valor.isdigit() and int(valor) < 2 ** 40:
+            return int(valor) / MB
+        return None
+    return None
+
+
+def _limite_rss_por_defecto() -> float:
+    limite = limite_contenedor_mb()
+    return round(limite * FRACCION_CONTENEDOR) if limite else 900.0
+
+
+# Reciclar el navegador entre registros al superar este RSS (0 = sin límite).
+# Por defecto, una fracción del límite del contenedor: en el plan starter de
+# Render (512 MB) el reciclaje debe llegar antes que el OOM killer
+BROWSER_MAX_RSS_MB = float(os.getenv("BROWSER_MAX_RSS_MB") or _limite_rss_por_defecto())
+# ... o cada N registros procesados con el mismo Chrome (0 = nunca)
+BROWSER_RECYCLE_EVERY = int(os.getenv("BROWSER_RECYCLE_EVERY", "50"))
+
+
+def rss_arbol(pid: Optional[int]) -> Optional[int]:
+    """RSS en bytes de un proceso y todos sus descendientes (chromedriver → Chrome → renderers)"""
+    if psutil is None or not pid:
+        return None
+    try:
+        raiz = psutil.Process(pid)
+        procesos = [raiz] + raiz.children(recursive=True)
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return None
+
+    total = 0
+    for proceso in procesos:
+        try:
+            total += proceso.memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            # Un renderer puede terminar entre children() y memory_info()
+            continue
+    return total
+
+
+class MonitorMemoria:
+    """Muestras de memoria del navegador durante una tarea (pico y promedio)"""
+
+    __slots__ = ("muestras", "suma_mb", "pico_mb", "reciclajes")
+
+    def __init__(self, muestras: int = 0, promedio_mb: Optional[float] = None,
+                 pico_mb: Optional[float] = None, reciclajes: int = 0):
+        # Al reanudar una tarea se parte de lo ya medido
+        self.muestras = muestras
+        self.suma_mb = (promedio_mb or 0.0) * muestras
+        self.pico_mb = pico_mb or 0.0
+        self.reciclajes = reciclajes
+
+    def registrar(self, rss_bytes: int) -> float:
+        rss_mb = rss_bytes / MB
+        self.muestras += 1
+        self.suma_mb += rss_mb
+        self.pico_mb = max(self.pico_mb, rss_mb)
+        return rss_mb
+
+    def resumen(self) -> Dict:
+        """Campos de TaskRecord con las estadísticas de memoria"""
+        return {
+            "memory_samples": self.muestras,
+            "memory_peak_mb": round(self.pico_mb, 1) if self.muestras else None,
+            "memory_avg_mb": round(self.suma_mb / self.muestras, 1) if self.muestras else None,
+            "browser_recycles": self.reciclajes
+        }
+
+
+def motivo_reciclaje(rss_mb: Optional[float], registros: int) -> Optional[str]:
+    """Razón para reciclar el navegador antes del siguiente registro (None = seguir)"""
+    if rss_mb is not None and BROWSER_MAX_RSS_MB > 0 and rss_mb > BROWSER_MAX_RSS_MB:
+        return f"memoria {rss_mb:.0f} MB > {BROWSER_MAX_RSS_MB:.0f} MB"
+    if BROWSER_RECYCLE_EVERY > 0 and registros >= BROWSER_RECYCLE_EVERY:
+        return f"{registros} registros con el mismo navegador"
+    return None
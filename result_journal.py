@@ -0,0 +1,161 @@
+import os
+import io
+import csv
+import json
+from typing import Dict, Iterator, Optional
+
+import xlsxwriter
+
+# === COLUMNAS DEL REPORTE DE RESULTADOS ===
+HEADERS_RESULTADO = [
+    "No. Fila Original", "No. Reserva", "Nombre Completo",
+    "Correo", "Código Afiliación", "Afiliador", "Estado",
+    "Observaciones", "Fecha Proceso"
+]
+
+CAMPOS_RESULTADO = [
+    "fila", "reserva", "nombre", "correo", "codigo",
+    "afiliador", "estado", "observaciones", "fecha"
+]
+
+
+def ruta_diario(temp_dir: str, result_filename: str) -> str:
+    """El diario vive junto al .xlsx final con extensión .jsonl"""
+    return os.path.join(temp_dir, os.path.splitext(result_filename)[0] + ".jsonl")
+
+
+class DiarioResultados:
+    """
+    Diario de resultados de solo-anexar (JSONL): una línea por registro procesado.
+    Escribir una fila cuesta lo mismo sin importar el tamaño del reporte.
+    """
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        # Al reanudar, una línea a medio escribir antes de una caída se descarta
+        _descartar_linea_incompleta(ruta)
+        self._archivo = open(ruta, "a", encoding="utf-8")
+
+    def agregar(self, resultado: Dict):
+        """Anexar un resultado y vaciar el buffer para que sea visible de inmediato"""
+        fila = {campo: resultado.get(campo) for campo in CAMPOS_RESULTADO}
+        self._archivo.write(json.dumps(fila, ensure_ascii=False, default=str) + "\n")
+        self._archivo.flush()
+
+    def close(self):
+        if not self._archivo.closed:
+            self._archivo.close()
+
+
+def leer_diario(ruta: str, hasta_byte: Optional[int] = None) -> Iterator[Dict]:
+    """
+    Leer el diario; ignora una última línea incompleta (escritura en curso).
+    Con hasta_byte se lee una instantánea fija aunque el diario siga creciendo.
+    """
+    leidos = 0
+    with open(ruta, "rb") as f:
+        for linea in f:
+            leidos += len(linea)
+            if hasta_byte is not None and leidos > hasta_byte:
+                break
+            if not linea.endswith(b"\n"):
+                break
+            yield json.loads(linea)
+
+
+def leer_diario_ordenado(ruta: str, hasta_byte: Optional[int] = None) -> Iterator[Dict]:
+    """
+    Leer el diario en el orden de la hoja subida (por fila) y no en el de
+    procesamiento. En memoria solo queda un índice (fila, posición) por registro.
+    """
+    indice = []
+    leidos = 0
+    with open(ruta, "rb") as f:
+        for linea in f:
+            inicio = leidos
+            leidos += len(linea)
+            if hasta_byte is not None and leidos > hasta_byte:
+                break
+            if not linea.endswith(b"\n"):
+                break
+            fila = json.loads(linea).get("fila")
+            indice.append((fila is None, fila or 0, inicio))
+
+        indice.sort()
+        for _, _, inicio in indice:
+            f.seek(inicio)
+            yield json.loads(f.readline())
+
+
+def filas_registradas(ruta: str) -> Dict[int, str]:
+    """{fila original: estado} de los registros ya anexados (vacío si no hay diario)"""
+    if not os.path.exists(ruta):
+        return {}
+    return {resultado.get("fila"): resultado.get("estado") for resultado in leer_diario(ruta)}
+
+
+def _descartar_linea_incompleta(ruta: str):
+    """Truncar el diario hasta el último salto de línea completo"""
+    try:
+        with open(ruta, "rb+") as f:
+            fin = f.seek(0, os.SEEK_END)
+            posicion = fin
+            while posicion > 0:
+                inicio = max(posicion - 65536, 0)
+                f.seek(inicio)
+                bloque = f.read(posicion - inicio)
+                corte = bloque.rfind(b"\n")
+                if corte != -1:
+                    posicion = inicio + corte + 1
+                    break
+                posicion = inicio
+            if posicion < fin:
+                f.truncate(posicion)
+    except FileNotFoundError:
+        pass
+
+
+def exportar_xlsx(ruta_jsonl: str, ruta_xlsx: str) -> int:
+    """Generar el .xlsx final, ordenado por fila, con xlsxwriter (constant_memory)"""
+    wb = xlsxwriter.Workbook(ruta_xlsx, {"constant_memory": True})
+    try:
+        ws = wb.add_worksheet("Afiliaciones")
+        ws.write_row(0, 0, HEADERS_RESULTADO)
+
+        filas = 0
+        for filas, resultado in enumerate(leer_diario_ordenado(ruta_jsonl), start=1):
+            ws.write_row(filas, 0, [resultado.get(campo) for campo in CAMPOS_RESULTADO])
+    finally:
+        wb.close()
+
+    return filas
+
+
+# === EXPORTACIÓN BAJO DEMANDA ===
+FORMATOS_EXPORTACION = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson"
+}
+
+
+def iterar_csv(ruta_jsonl: str, hasta_byte: Optional[int] = None) -> Iterator[bytes]:
+    """Renderizar el diario como CSV, fila por fila en el orden de la hoja subida"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    # BOM para que Excel reconozca UTF-8 (acentos en nombres)
+    writer.writerow(HEADERS_RESULTADO)
+    yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+
+    for resultado in leer_diario_ordenado(ruta_jsonl, hasta_byte):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow([resultado.get(campo) for campo in CAMPOS_RESULTADO])
+        yield buffer.getvalue().encode("utf-8")
+
+
+def iterar_ndjson(ruta_jsonl: str, hasta_byte: Optional[int] = None) -> Iterator[bytes]:
+    """Renderizar el diario como NDJSON (un objeto por línea, ordenado por fila)"""
+    for resultado in leer_diario_ordenado(ruta_jsonl, hasta_byte):
+        yield (json.dumps(resultado, ensure_ascii=False) + "\n").encode("utf-8")
@@ -2,8 +2,12 @@ import os
 import time
 import re
 import asyncio
+import uuid
+import functools
+from urllib.parse import quote, urlsplit
 import subprocess
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.service import Service
@@ -12,18 +16,30 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import Select
 from selenium.common.exceptions import NoSuchElementException, TimeoutException
 
+from driver_discovery import es_produccion, invalidar_cache, obtener_binarios
+from email_index import EXTENSIONES_PERMITIDAS
+
 # === CONFIGURACIÓN ===
 URLS_AFILIACION = {
     "express": "https://www.joinmarriottbonvoy.com/calaqr/s/ES/ch/cunxc",
     "junior": "https://www.joinmarriottbonvoy.com/calaqr/s/ES/ch/cunjc"
 }
 
-EXTENSIONES_PERMITIDAS = {
-    'hotmail.com', 'hotmail.es', 'hotmail.mx',
-    'gmail.com', 'gmail.mx',
-    'outlook.com', 'outlook.es', 'outlook.mx',
-    'icloud.com'
-}
+# Orígenes cuyo storage se limpia al pasar el navegador a otra tarea: los de
+# las URLs de afiliación y los de marriott.com a los que redirige el flujo (los
+# demás orígenes visitados se registran durante cada afiliación)
+ORIGENES_AFILIACION = sorted(
+    {"https://" + url.split("/")[2] for url in URLS_AFILIACION.values()}
+    | {"https://www.marriott.com", "https://marriott.com", "https://www.marriottbonvoy.com"}
+)
+
+# chromedriver en su propio grupo de procesos (pgid = su PID): al cerrar se
+# mata el grupo completo con Chrome aunque driver.quit() falle
+GRUPO_PROPIO = {"start_new_session": True}
+
+# Sonda de arranque: página local (sin red) que expone una señal de listo en el título
+TIMEOUT_SONDA = float(os.getenv("BROWSER_PROBE_TIMEOUT", "10"))
+HTML_SONDA = "<html><head><title>{token}</title></head><body id='{token}'></body></html>"
 
 class MarriottProcessor:
     def __init__(self, tipo_afiliacion, nombre_afiliador):
@@ -32,6 +48,60 @@ class MarriottProcessor:
         self.driver = None
         self.wait = None
         self.correos_procesados = set()
+        self.origenes_visitados = set(ORIGENES_AFILIACION)
+        self.ultima_sonda_ms = None
+        # Hilo propio del driver: las llamadas de Selenium bloquean hasta 30s
+        # (wait.until, esperas de página) y no deben frenar el event loop
+        self._executor = None
+
+    async def _en_hilo(self, funcion, *args, **kwargs):
+        """Ejecutar una llamada bloqueante de Selenium en el hilo del driver y esperarla"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="selenium-driver")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(funcion, *args, **kwargs))
+
+    @property
+    def pid_driver(self):
+        """PID de chromedriver: raíz del árbol de procesos de Chrome y id de su grupo"""
+        try:
+            return self.driver.service.process.pid
+        except AttributeError:
+            return None
+
+    def asignar_tarea(self, tipo_afiliacion, nombre_afiliador, correos_procesados):
+        """Reutilizar el navegador ya abierto para otra tarea (tipo, afiliador y duplicados propios)"""
+        self.tipo_afiliacion = tipo_afiliacion.lower()
+        self.nombre_afiliador = nombre_afiliador
+        self.correos_procesados = correos_procesados
+
+    def _registrar_origen(self):
+        """Anotar el origen de la página actual (redirecciones incluidas) para limpiarlo después"""
+        partes = urlsplit(self.driver.current_url)
+        if partes.scheme in ("http", "https") and partes.netloc:
+            self.origenes_visitados.add(f"{partes.scheme}://{partes.netloc}")
+
+    def _limpiar_sesion(self):
+        self._registrar_origen()
+        # Cookies de todos los dominios (delete_all_cookies solo borra las del documento actual)
+        self.driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        for origen in sorted(self.origenes_visitados):
+            self.driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origen, "storageTypes": "all"})
+        self.origenes_visitados = set(ORIGENES_AFILIACION)
+        self.driver.get("about:blank")
+
+    async def limpiar_sesion(self):
+        """Dejar el navegador como recién abierto (cookies, storage, correos) para la siguiente tarea"""
+        self.correos_procesados = set()
+        if not self.driver:
+            return False
+        try:
+            await self._en_hilo(self._limpiar_sesion)
+            print("[🧹] Sesión del navegador limpiada")
+            return True
+        except Exception as e:
+            print(f"[⚠️] Error limpiando sesión del navegador: {e}")
+            return False
 
     async def setup_chrome_driver(self):
         """Configuración MEJORADA para Render con detección inteligente"""
@@ -39,24 +109,20 @@ class MarriottProcessor:
             print("[🔧] Configurando ChromeDriver para entorno de producción...")
             
             # Detectar entorno
-            is_render = os.getenv('RENDER') or 'render.com' in os.getenv('RENDER_EXTERNAL_URL', '')
-            is_production = is_render or os.getenv('PRODUCTION') or os.getenv('DYNO')
-            
-            print(f"[📍] Entorno detectado - Render: {is_render}, Producción: {is_production}")
+            is_production = es_produccion()
+            print(f"[📍] Entorno detectado - Producción: {is_production}")
             
             # Configurar opciones de Chrome
             options = self._get_chrome_options(is_production)
             
-            if is_production:
-                driver = await self._setup_production_chrome(options)
-            else:
-                driver = await self._setup_local_chrome(options)
+            # Rutas descubiertas una vez por proceso (y cacheadas en disco)
+            driver = await self._en_hilo(self._lanzar_chrome, options, is_production)
             
             if driver:
                 self.driver = driver
                 self.wait = WebDriverWait(self.driver, 30)
                 
-                # Test de conectividad
+                # Renderer listo (sin depender de servicios externos)
                 await self._test_browser_connection()
                 
                 # Anti-detección
@@ -71,214 +137,32 @@ class MarriottProcessor:
             print(f"[🚨] Error configurando ChromeDriver: {e}")
             return False
 
-    async def _setup_production_chrome(self, options):
-        """Configuración para producción con rutas específicas de Render"""
-        print("[🏭] Configurando Chrome para producción...")
-        
-        # Lista de configuraciones específicas para RENDER
-        configs = [
-            # Config 1: Buildpack de Google Chrome en Render/Heroku
-            {
-                'name': 'Buildpack Google Chrome',
-                'chrome_bin': '/app/.heroku-buildpack-google-chrome/opt/google/chrome/chrome',
-                'driver_path': '/app/.chromedriver/bin/chromedriver'
-            },
-            # Config 2: Ubicación alternativa del buildpack Chrome
-            {
-                'name': 'Buildpack Chrome Alt',
-                'chrome_bin': '/app/.google-chrome/chrome',
-                'driver_path': '/app/.chromedriver/chromedriver'
-            },
-            # Config 3: Variables de entorno personalizadas
-            {
-                'name': 'Variables Entorno',
-                'chrome_bin': os.getenv('CHROME_BIN', '/usr/bin/google-chrome-stable'),
-                'driver_path': os.getenv('CHROMEDRIVER_PATH', '/usr/local/bin/chromedriver')
-            },
-            # Config 4: Sistema estándar Linux
-            {
-                'name': 'Sistema Linux',
-                'chrome_bin': '/usr/bin/google-chrome-stable',
-                'driver_path': '/usr/bin/chromedriver'
-            },
-            # Config 5: Chrome genérico
-            {
-                'name': 'Chrome genérico',
-                'chrome_bin': '/usr/bin/google-chrome',
-                'driver_path': '/usr/local/bin/chromedriver'
-            },
-            # Config 6: Chromium como respaldo
-            {
-                'name': 'Chromium respaldo',
-                'chrome_bin': '/usr/bin/chromium-browser',
-                'driver_path': '/usr/bin/chromedriver'
-            }
-        ]
-        
-        for config in configs:
-            try:
-                print(f"[🔄] Probando {config['name']}...")
-                
-                # Verificar binarios
-                chrome_exists = os.path.isfile(config['chrome_bin'])
-                driver_exists = os.path.isfile(config['driver_path'])
-                
-                print(f"[📍] Chrome: {config['chrome_bin']} ({'✅' if chrome_exists else '❌'})")
-                print(f"[📍] Driver: {config['driver_path']} ({'✅' if driver_exists else '❌'})")
-                
-                if chrome_exists and driver_exists:
-                    # Hacer ejecutables
-                    try:
-                        os.chmod(config['chrome_bin'], 0o755)
-                        os.chmod(config['driver_path'], 0o755)
-                    except Exception as e:
-                        print(f"[⚠️] No se pudieron cambiar permisos: {e}")
-                    
-                    # Configurar binario de Chrome
-                    options.binary_location = config['chrome_bin']
-                    
-                    # Crear servicio
-                    service = Service(config['driver_path'])
-                    
-                    # Intentar crear driver
-                    driver = webdriver.Chrome(service=service, options=options)
-                    print(f"[🎉] {config['name']} configurado exitosamente!")
-                    return driver
-                
-            except Exception as e:
-                print(f"[⚠️] {config['name']} falló: {str(e)[:100]}...")
-                continue
-        
-        # Si todo falla, buscar dinámicamente
-        print("[🔄] Búsqueda dinámica como último recurso...")
-        try:
-            # Buscar Chrome
-            chrome_search = [
-                "/app/.heroku-buildpack-google-chrome/opt/google/chrome/chrome",
-                "/app/.google-chrome/chrome", 
-                "/usr/bin/google-chrome-stable",
-                "/usr/bin/google-chrome",
-                "/usr/bin/chromium-browser"
-            ]
-            
-            chrome_found = None
-            for path in chrome_search:
-                if os.path.isfile(path):
-                    chrome_found = path
-                    break
-            
-            # Buscar ChromeDriver
-            driver_search = [
-                "/app/.chromedriver/bin/chromedriver",
-                "/app/.chromedriver/chromedriver",
-                "/usr/bin/chromedriver",
-                "/usr/local/bin/chromedriver"
-            ]
-            
-            driver_found = None
-            for path in driver_search:
-                if os.path.isfile(path):
-                    driver_found = path
-                    break
-            
-            if chrome_found and driver_found:
-                print(f"[🎯] Búsqueda dinámica exitosa:")
-                print(f"[📍] Chrome encontrado: {chrome_found}")
-                print(f"[📍] Driver encontrado: {driver_found}")
-                
-                options.binary_location = chrome_found
-                service = Service(driver_found)
-                driver = webdriver.Chrome(service=service, options=options)
-                return driver
-        
-        except Exception as e:
-            print(f"[❌] Búsqueda dinámica falló: {e}")
-        
-        raise Exception("❌ CRÍTICO: No se pudo configurar Chrome en ninguna configuración de producción")
-        
-        for config in configs:
-            try:
-                print(f"[🔄] Probando {config['name']}...")
-                
-                # Verificar binarios
-                chrome_exists = os.path.isfile(config['chrome_bin'])
-                driver_exists = os.path.isfile(config['driver_path'])
-                
-                print(f"[📍] Chrome: {config['chrome_bin']} ({'✅' if chrome_exists else '❌'})")
-                print(f"[📍] Driver: {config['driver_path']} ({'✅' if driver_exists else '❌'})")
-                
-                if chrome_exists and driver_exists:
-                    # Hacer ejecutables
-                    os.chmod(config['chrome_bin'], 0o755)
-                    os.chmod(config['driver_path'], 0o755)
-                    
-                    # Configurar binario de Chrome
-                    options.binary_location = config['chrome_bin']
-                    
-                    # Crear servicio
-                    service = Service(config['driver_path'])
-                    
-                    # Intentar crear driver
-                    driver = webdriver.Chrome(service=service, options=options)
-                    print(f"[🎉] {config['name']} configurado exitosamente!")
-                    return driver
-                
-            except Exception as e:
-                print(f"[⚠️] {config['name']} falló: {str(e)[:100]}...")
-                continue
-        
-        # Estrategia de respaldo: webdriver-manager
-        try:
-            print("[🔄] Intentando webdriver-manager como respaldo...")
-            from webdriver_manager.chrome import ChromeDriverManager
-            
-            # Instalar ChromeDriver
-            driver_path = ChromeDriverManager().install()
-            service = Service(driver_path)
-            
-            # Buscar Chrome automáticamente
-            chrome_paths = [
-                '/usr/bin/google-chrome-stable',
-                '/usr/bin/google-chrome',
-                '/usr/bin/chromium-browser',
-                '/opt/google/chrome/chrome'
-            ]
-            
-            for chrome_path in chrome_paths:
-                if os.path.isfile(chrome_path):
-                    options.binary_location = chrome_path
-                    break
-            
-            driver = webdriver.Chrome(service=service, options=options)
-            print("[✅] webdriver-manager exitoso!")
-            return driver
-            
-        except Exception as e:
-            print(f"[❌] webdriver-manager falló: {e}")
-        
-        raise Exception("Todas las configuraciones de producción fallaron")
+    def _crear_driver(self, options, binarios):
+        if binarios.get('chrome_bin'):
+            options.binary_location = binarios['chrome_bin']
+        return webdriver.Chrome(service=Service(binarios['driver_path'], popen_kw=GRUPO_PROPIO), options=options)
 
-    async def _setup_local_chrome(self, options):
-        """Configuración para desarrollo local"""
-        print("[🏠] Configurando Chrome para desarrollo local...")
-        
-        try:
-            # Intentar ChromeDriver del sistema
-            service = Service()
-            driver = webdriver.Chrome(service=service, options=options)
-            print("[✅] Chrome local configurado!")
-            return driver
-            
-        except Exception:
-            # Usar webdriver-manager para local
+    def _lanzar_chrome(self, options, is_production):
+        """Arrancar Chrome con los binarios ya validados; si fallan, probar el siguiente candidato"""
+        binarios = obtener_binarios(is_production)
+        fallidos = frozenset()
+        while binarios:
             try:
-                from webdriver_manager.chrome import ChromeDriverManager
-                service = Service(ChromeDriverManager().install())
-                driver = webdriver.Chrome(service=service, options=options)
-                print("[✅] Chrome local con webdriver-manager configurado!")
+                driver = self._crear_driver(options, binarios)
+                print(f"[🎉] Chrome iniciado con {binarios['name']}")
                 return driver
             except Exception as e:
-                raise Exception(f"No se pudo configurar Chrome local: {e}")
+                print(f"[⚠️] {binarios['name']} falló: {str(e)[:100]}... probando otros binarios")
+                fallidos |= {(binarios.get('chrome_bin'), binarios['driver_path'])}
+                invalidar_cache()
+                binarios = obtener_binarios(is_production, forzar=True, excluir=fallidos)
+
+        if not is_production:
+            # Sin binarios conocidos: dejar que Selenium Manager resuelva el driver
+            print("[🏠] Configurando Chrome local con Selenium Manager...")
+            return webdriver.Chrome(service=Service(popen_kw=GRUPO_PROPIO), options=options)
+
+        raise Exception("❌ CRÍTICO: No se encontraron binarios válidos de Chrome/ChromeDriver")
 
     def _get_chrome_options(self, is_production=True):
         """Opciones optimizadas de Chrome"""
@@ -340,28 +224,36 @@ class MarriottProcessor:
         
         return options
 
+    def _sonda_renderer(self):
+        """Cargar una página data: y esperar su señal de listo; retorna la latencia en ms"""
+        token = f"listo-{uuid.uuid4().hex[:12]}"
+        inicio = time.perf_counter()
+        self.driver.get("data:text/html;charset=utf-8," + quote(HTML_SONDA.format(token=token)))
+        WebDriverWait(self.driver, TIMEOUT_SONDA, poll_frequency=0.05).until(
+            lambda driver: driver.title == token and driver.find_elements(By.ID, token)
+        )
+        return round((time.perf_counter() - inicio) * 1000, 1)
+
     async def _test_browser_connection(self):
-        """Probar conexión del navegador"""
+        """Confirmar que el renderer responde; si no, cerrar Chrome y fallar el setup"""
+        print("[🧪] Probando renderer del navegador...")
         try:
-            print("[🧪] Probando conexión del navegador...")
-            self.driver.get("https://httpbin.org/ip")
-            await asyncio.sleep(2)
-            
-            # Verificar que la página cargó
-            page_title = self.driver.title
-            if page_title:
-                print(f"[✅] Navegador funcionando - Título: {page_title}")
-            else:
-                print("[⚠️] Navegador funciona pero sin título de página")
-                
+            self.ultima_sonda_ms = await self._en_hilo(self._sonda_renderer)
         except Exception as e:
-            print(f"[⚠️] Test de navegador parcialmente fallido: {e}")
+            detalle = "sin señal de listo" if isinstance(e, TimeoutException) else str(e)[:100]
+            try:
+                await self._en_hilo(self.driver.quit)
+            except Exception:
+                pass
+            self.driver = None
+            raise Exception(f"El renderer no respondió en {TIMEOUT_SONDA:g}s: {detalle}")
+        print(f"[✅] Navegador listo en {self.ultima_sonda_ms} ms")
 
     async def _setup_anti_detection(self):
         """Configurar anti-detección"""
         try:
             # Script para ocultar automatización
-            self.driver.execute_script("""
+            await self._en_hilo(self.driver.execute_script, """
                 Object.defineProperty(navigator, 'webdriver', {
                     get: () => undefined
                 });
@@ -635,15 +527,16 @@ class MarriottProcessor:
             # Abrir página de afiliación
             url = URLS_AFILIACION[self.tipo_afiliacion]
             print(f"[🌐] Abriendo: {url}")
-            self.driver.get(url)
+            await self._en_hilo(self.driver.get, url)
             
             # Esperar formulario
             await asyncio.sleep(3)  # Espera fija inicial
             
             try:
-                self.wait.until(EC.presence_of_element_located((By.ID, "partial_enroll_form")))
+                await self._en_hilo(self.wait.until, EC.presence_of_element_located((By.ID, "partial_enroll_form")))
             except TimeoutException:
                 print("[⚠️] Formulario tardó en cargar, continuando...")
+            await self._en_hilo(self._registrar_origen)
             
             await asyncio.sleep(1)
             
@@ -655,8 +548,8 @@ class MarriottProcessor:
                 (By.NAME, "first_name"),
                 (By.CSS_SELECTOR, "input[name*='first']")
             ]
-            campo_nombre = self.encontrar_elemento_inteligente(localizadores_nombre, "Campo nombre")
-            if not campo_nombre or not self.llenar_campo_inteligente(campo_nombre, nombre, "Nombre"):
+            campo_nombre = await self._en_hilo(self.encontrar_elemento_inteligente, localizadores_nombre, "Campo nombre")
+            if not campo_nombre or not await self._en_hilo(self.llenar_campo_inteligente, campo_nombre, nombre, "Nombre"):
                 return {"success": False, "error": "No se pudo llenar el nombre"}
             
             # 2. Apellido
@@ -665,8 +558,8 @@ class MarriottProcessor:
                 (By.NAME, "last_name"),
                 (By.CSS_SELECTOR, "input[name*='last']")
             ]
-            campo_apellido = self.encontrar_elemento_inteligente(localizadores_apellido, "Campo apellido")
-            if not campo_apellido or not self.llenar_campo_inteligente(campo_apellido, apellido, "Apellido"):
+            campo_apellido = await self._en_hilo(self.encontrar_elemento_inteligente, localizadores_apellido, "Campo apellido")
+            if not campo_apellido or not await self._en_hilo(self.llenar_campo_inteligente, campo_apellido, apellido, "Apellido"):
                 return {"success": False, "error": "No se pudo llenar el apellido"}
             
             # 3. Email
@@ -675,15 +568,15 @@ class MarriottProcessor:
                 (By.NAME, "email_address"),
                 (By.CSS_SELECTOR, "input[type='email']")
             ]
-            campo_email = self.encontrar_elemento_inteligente(localizadores_email, "Campo email")
-            if not campo_email or not self.llenar_campo_inteligente(campo_email, correo, "Email"):
+            campo_email = await self._en_hilo(self.encontrar_elemento_inteligente, localizadores_email, "Campo email")
+            if not campo_email or not await self._en_hilo(self.llenar_campo_inteligente, campo_email, correo, "Email"):
                 return {"success": False, "error": "No se pudo llenar el email"}
             
             # 4. Seleccionar país
-            self.seleccionar_pais_inteligente()
+            await self._en_hilo(self.seleccionar_pais_inteligente)
             
             # 5. Marcar checkboxes
-            self.marcar_checkboxes_inteligente()
+            await self._en_hilo(self.marcar_checkboxes_inteligente)
             
             # Pequeña pausa antes de enviar
             await asyncio.sleep(2)
@@ -696,23 +589,24 @@ class MarriottProcessor:
                 (By.XPATH, "//input[@type='submit']")
             ]
             
-            boton_submit = self.encontrar_elemento_inteligente(localizadores_submit, "Botón enviar")
+            boton_submit = await self._en_hilo(self.encontrar_elemento_inteligente, localizadores_submit, "Botón enviar")
             if not boton_submit:
                 return {"success": False, "error": "Botón de envío no encontrado"}
             
             # Enviar
             try:
-                self.driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", boton_submit)
+                await self._en_hilo(self.driver.execute_script, "arguments[0].scrollIntoView({block: 'center'});", boton_submit)
                 await asyncio.sleep(0.5)
-                self.driver.execute_script("arguments[0].click();", boton_submit)
+                await self._en_hilo(self.driver.execute_script, "arguments[0].click();", boton_submit)
             except Exception:
-                boton_submit.click()
+                await self._en_hilo(boton_submit.click)
             
             print("[📤] Formulario enviado")
             
             # 7. Buscar código
             await asyncio.sleep(3)  # Esperar respuesta del servidor
-            codigo = self.buscar_codigo_afiliacion_inteligente()
+            codigo = await self._en_hilo(self.buscar_codigo_afiliacion_inteligente)
+            await self._en_hilo(self._registrar_origen)
             
             if codigo:
                 print(f"[🎉] ¡ÉXITO! {nombre_completo} | Código: {codigo}")
@@ -735,7 +629,10 @@ class MarriottProcessor:
         """Cerrar navegador"""
         if self.driver:
             try:
-                self.driver.quit()
+                await self._en_hilo(self.driver.quit)
                 print("[✅] Navegador cerrado")
             except Exception as e:
-                print(f"[⚠️] Error cerrando navegador: {e}")
\ No newline at end of file
+                print(f"[⚠️] Error cerrando navegador: {e}")
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
\ No newline at end of file
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+from typing import Dict, Optional, Set
+
+# Eventos que puede acumular un suscriptor lento antes de descartar los más viejos
+MAX_EVENTOS_PENDIENTES = 500
+
+
+class BusEventosTareas:
+    """
+    Canal de eventos por tarea (progreso, logs, resultados) para clientes SSE.
+    Cada evento incrementa la versión de la tarea, que permite ETags y long-poll.
+    Los eventos se entregan en el event loop aunque se publiquen desde otro hilo.
+    """
+
+    def __init__(self):
+        self._suscriptores: Dict[str, Set[asyncio.Queue]] = {}
+        self._versiones: Dict[str, int] = {}
+        self._cambios: Dict[str, asyncio.Event] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._hilo_loop: Optional[int] = None
+
+    def vincular_loop(self, loop: asyncio.AbstractEventLoop):
+        """Registrar el event loop de la aplicación (llamar al iniciar)"""
+        self._loop = loop
+        self._hilo_loop = threading.get_ident()
+
+    def suscribir(self, task_id: str) -> asyncio.Queue:
+        cola = asyncio.Queue(maxsize=MAX_EVENTOS_PENDIENTES)
+        self._suscriptores.setdefault(task_id, set()).add(cola)
+        return cola
+
+    def desuscribir(self, task_id: str, cola: asyncio.Queue):
+        colas = self._suscriptores.get(task_id)
+        if colas is not None:
+            colas.discard(cola)
+            if not colas:
+                del self._suscriptores[task_id]
+
+    def publicar(self, task_id: str, tipo: str, datos: Dict):
+        """Registrar un cambio de la tarea y enviarlo a sus suscriptores"""
+        evento = {"type": tipo, "data": datos}
+        if self._loop is None or threading.get_ident() == self._hilo_loop:
+            self._entregar(task_id, evento)
+        else:
+            self._loop.call_soon_threadsafe(self._entregar, task_id, evento)
+
+    def _entregar(self, task_id: str, evento: Dict):
+        version = self._versiones.get(task_id, 0) + 1
+        self._versiones[task_id] = version
+        evento["version"] = version
+
+        # Despertar a los long-poll que esperan un cambio
+        cambio = self._cambios.pop(task_id, None)
+        if cambio is not None:
+            cambio.set()
+
+        for cola in list(self._suscriptores.get(task_id, ())):
+            if cola.full():
+                # Cliente lento: descartar el evento más viejo
+                cola.get_nowait()
+            cola.put_nowait(evento)
+
+    # === VERSIONES ===
+    def version(self, task_id: str) -> int:
+        """Versión actual de la tarea (aumenta con cada cambio)"""
+        return self._versiones.get(task_id, 0)
+
+    async def esperar_version(self, task_id: str, version: int, timeout: float) -> int:
+        """Esperar hasta que la tarea alcance la versión indicada o se agote el timeout"""
+        loop = asyncio.get_running_loop()
+        limite = loop.time() + timeout
+        while self.version(task_id) < version:
+            restante = limite - loop.time()
+            if restante <= 0:
+                break
+            cambio = self._cambios.setdefault(task_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(cambio.wait(), timeout=restante)
+            except asyncio.TimeoutError:
+                break
+        return self.version(task_id)
+
+    def olvidar(self, task_id: str):
+        """Liberar el estado de una tarea eliminada"""
+        self._versiones.pop(task_id, None)
+        cambio = self._cambios.pop(task_id, None)
+        if cambio is not None:
+            cambio.set()
@@ -0,0 +1,158 @@
+import os
+import queue
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+
+class RegistroLogs:
+    """
+    Logs por tarea: un buffer circular acotado en memoria para lecturas rápidas
+    (/status) y un archivo completo por tarea escrito por un hilo aparte,
+    de modo que agregar un log nunca espera al disco. De las tareas
+    terminadas solo se conservan en memoria sus últimas líneas.
+    """
+
+    def __init__(self, directorio: str, tamano_buffer: int = 50, lineas_conservadas: int = 10):
+        self.directorio = directorio
+        self.tamano_buffer = tamano_buffer
+        self.lineas_conservadas = lineas_conservadas
+        self._buffers: Dict[str, Deque[str]] = {}
+        # Últimas líneas de tareas liberadas (o leídas del archivo tras un reinicio)
+        self._finales: Dict[str, Tuple[str, ...]] = {}
+        self._cola: "queue.Queue[Optional[Tuple[str, str]]]" = queue.Queue()
+        self._hilo: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        os.makedirs(directorio, exist_ok=True)
+
+    def ruta(self, task_id: str) -> str:
+        return os.path.join(self.directorio, f"{task_id}.log")
+
+    # === ESCRITURA ===
+    def agregar(self, task_id: str, linea: str):
+        """Agregar una línea al buffer y encolarla para el archivo completo"""
+        buffer = self._buffers.get(task_id)
+        if buffer is None:
+            # Tarea reanudada: continuar desde las líneas conservadas
+            buffer = self._buffers.setdefault(
+                task_id, deque(self._finales.pop(task_id, ()), maxlen=self.tamano_buffer)
+            )
+        buffer.append(linea)
+
+        self._iniciar_hilo()
+        self._cola.put((task_id, linea))
+
+    def _iniciar_hilo(self):
+        if self._hilo is None:
+            with self._lock:
+                if self._hilo is None:
+                    self._hilo = threading.Thread(target=self._escribir, name="task-log-spill", daemon=True)
+                    self._hilo.start()
+
+    def _escribir(self):
+        """Hilo de volcado: agrupa las líneas pendientes por tarea y las anexa a su archivo"""
+        while True:
+            item = self._cola.get()
+            lote = [item]
+            # Tomar todo lo que ya esté en cola para escribir en bloque
+            while True:
+                try:
+                    lote.append(self._cola.get_nowait())
+                except queue.Empty:
+                    break
+
+            por_tarea: Dict[str, List[str]] = {}
+            detener = False
+            for entrada in lote:
+                if entrada is None:
+                    detener = True
+                    continue
+                task_id, linea = entrada
+                por_tarea.setdefault(task_id, []).append(linea)
+
+            for task_id, lineas in por_tarea.items():
+                try:
+                    with open(self.ruta(task_id), "a", encoding="utf-8") as f:
+                        f.write("\n".join(l.replace("\n", " ") for l in lineas) + "\n")
+                except Exception as e:
+                    print(f"[⚠️] Error guardando logs de {task_id}: {e}")
+
+            for _ in lote:
+                self._cola.task_done()
+
+            if detener:
+                return
+
+    # === LECTURA ===
+    def recientes(self, task_id: str, cantidad: int) -> List[str]:
+        """
+        Últimas líneas de la tarea: del buffer, de las conservadas al liberarla
+        o, tras un reinicio, del final del archivo (una sola vez por tarea)
+        """
+        buffer = self._buffers.get(task_id)
+        if buffer is not None:
+            return list(buffer)[-cantidad:]
+
+        finales = self._finales.get(task_id)
+        if finales is None:
+            finales = self._leer_final(task_id, max(cantidad, self.lineas_conservadas))
+            if finales:
+                self._finales[task_id] = finales[-self.lineas_conservadas:]
+        return list(finales[-cantidad:])
+
+    def _leer_final(self, task_id: str, cantidad: int) -> Tuple[str, ...]:
+        """Últimas líneas del archivo, leyéndolo por bloques desde el final"""
+        try:
+            with open(self.ruta(task_id), "rb") as f:
+                posicion = f.seek(0, os.SEEK_END)
+                datos = b""
+                while posicion > 0 and datos.count(b"\n") <= cantidad:
+                    bloque = min(8192, posicion)
+                    posicion -= bloque
+                    f.seek(posicion)
+                    datos = f.read(bloque) + datos
+        except FileNotFoundError:
+            return ()
+        lineas = datos.decode("utf-8", errors="replace").splitlines()
+        return tuple(lineas[-cantidad:])
+
+    def leer(self, task_id: str, offset: int, limit: int) -> Tuple[List[str], int]:
+        """Página del log completo: (líneas, total de líneas)"""
+        lineas = []
+        total = 0
+        try:
+            with open(self.ruta(task_id), "r", encoding="utf-8") as f:
+                for total, linea in enumerate(f, start=1):
+                    if offset < total <= offset + limit:
+                        lineas.append(linea.rstrip("\n"))
+        except FileNotFoundError:
+            pass
+        return lineas, total
+
+    # === MANTENIMIENTO ===
+    def liberar(self, task_id: str):
+        """
+        Reducir el buffer de una tarea terminada a sus últimas líneas (las que
+        muestra /status); el log completo queda en el archivo. No espera al disco.
+        """
+        buffer = self._buffers.pop(task_id, None)
+        if buffer:
+            self._finales[task_id] = tuple(buffer)[-self.lineas_conservadas:]
+
+    def eliminar(self, task_id: str):
+        """Borrar buffer y archivo de una tarea (bloquea hasta volcar la cola: llamar fuera del event loop)"""
+        # Las líneas pendientes de la tarea volverían a crear el archivo después de borrarlo
+        self._cola.join()
+        self._buffers.pop(task_id, None)
+        self._finales.pop(task_id, None)
+        try:
+            os.remove(self.ruta(task_id))
+        except FileNotFoundError:
+            pass
+
+    def cerrar(self):
+        """Vaciar la cola pendiente y detener el hilo de volcado"""
+        if self._hilo is not None:
+            self._cola.put(None)
+            self._hilo.join(timeout=5)
+            self._hilo = None
@@ -0,0 +1,152 @@
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+# Estados de un registro procesado que cuentan como éxito
+ESTADOS_EXITOSOS = ("EXITOSO",)
+
+
+def _a_timestamp(valor) -> float:
+    """Aceptar timestamps o fechas ISO (tareas guardadas por versiones anteriores)"""
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    try:
+        return datetime.fromisoformat(valor).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+def _a_iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+
+# Campos persistidos de una tarea
+CAMPOS_TAREA = (
+    "task_id", "status", "progress", "total_records", "processed_records",
+    "successful_records", "error_records", "rejected_records",
+    "current_processing", "message", "result_file_url", "result_filename",
+    "partial_results_url", "tipo_afiliacion", "nombre_afiliador",
+    "file_hash", "file_size", "last_completed_row", "created_ts", "updated_ts",
+    "memory_samples", "memory_peak_mb", "memory_avg_mb", "browser_recycles"
+)
+
+
+class TaskRecord:
+    """
+    Estado de una tarea con atributos fijos (__slots__).
+    Los contadores se actualizan de forma incremental por cada resultado y las
+    fechas se guardan como timestamps; solo se formatean al construir la
+    respuesta, y el texto se reutiliza mientras la fecha no cambie.
+    """
+
+    __slots__ = CAMPOS_TAREA + ("_fechas_iso",)
+
+    def __init__(
+        self,
+        task_id: str,
+        status: str = "pending",
+        total_records: int = 0,
+        tipo_afiliacion: Optional[str] = None,
+        nombre_afiliador: Optional[str] = None,
+        **campos
+    ):
+        ahora = time.time()
+        self.task_id = task_id
+        self.status = status
+        self.progress = 0
+        self.total_records = total_records
+        self.processed_records = 0
+        self.successful_records = 0
+        self.error_records = 0
+        self.rejected_records = 0
+        self.current_processing = "Preparando..."
+        self.message = ""
+        self.result_file_url = None
+        self.result_filename = None
+        self.partial_results_url = None
+        self.tipo_afiliacion = tipo_afiliacion
+        self.nombre_afiliador = nombre_afiliador
+        self.file_hash = None
+        self.file_size = None
+        self.last_completed_row = None
+        self.created_ts = ahora
+        self.updated_ts = ahora
+        self.memory_samples = 0
+        self.memory_peak_mb = None
+        self.memory_avg_mb = None
+        self.browser_recycles = 0
+        self._fechas_iso = (None, None, None)
+        for campo, valor in campos.items():
+            setattr(self, campo, valor)
+
+    # === ACTUALIZACIÓN ===
+    def actualizar(self, **campos):
+        """Asignar campos (un nombre desconocido lanza AttributeError)"""
+        for campo, valor in campos.items():
+            setattr(self, campo, valor)
+        self.updated_ts = time.time()
+
+    def registrar_resultado(self, estado: str, fila: Optional[int] = None):
+        """Contar un registro terminado y recalcular el progreso en O(1)"""
+        self.processed_records += 1
+        if fila is not None:
+            self.last_completed_row = fila
+        if estado in ESTADOS_EXITOSOS:
+            self.successful_records += 1
+        else:
+            self.error_records += 1
+        if self.total_records:
+            self.progress = self.processed_records * 100 // self.total_records
+        self.updated_ts = time.time()
+
+    # === ESTADÍSTICAS DERIVADAS ===
+    @property
+    def remaining_records(self) -> int:
+        return max(self.total_records - self.processed_records, 0)
+
+    @property
+    def success_rate(self) -> float:
+        if not self.processed_records:
+            return 0.0
+        return round(self.successful_records / self.processed_records * 100, 2)
+
+    def _formatear_fechas(self):
+        created_iso, updated_ts, updated_iso = self._fechas_iso
+        if created_iso is None:
+            created_iso = _a_iso(self.created_ts)
+        if updated_ts != self.updated_ts:
+            updated_ts, updated_iso = self.updated_ts, _a_iso(self.updated_ts)
+        self._fechas_iso = (created_iso, updated_ts, updated_iso)
+        return created_iso, updated_iso
+
+    @property
+    def created_at(self) -> str:
+        return self._formatear_fechas()[0]
+
+    @property
+    def last_updated(self) -> str:
+        return self._formatear_fechas()[1]
+
+    def contadores(self) -> Dict:
+        """Campos que cambian con cada resultado (payload de eventos de progreso)"""
+        return {
+            "progress": self.progress,
+            "processed_records": self.processed_records,
+            "successful_records": self.successful_records,
+            "error_records": self.error_records
+        }
+
+    # === SERIALIZACIÓN ===
+    def to_dict(self) -> Dict:
+        """Representación para persistir (timestamps numéricos)"""
+        return {campo: getattr(self, campo) for campo in CAMPOS_TAREA}
+
+    @classmethod
+    def from_dict(cls, datos: Dict) -> "TaskRecord":
+        datos = dict(datos)
+        # Tareas guardadas antes de los timestamps numéricos
+        created = datos.pop("created_at", None)
+        updated = datos.pop("last_updated", None)
+        datos.setdefault("created_ts", _a_timestamp(created))
+        datos.setdefault("updated_ts", _a_timestamp(updated) if updated else datos["created_ts"])
+        return cls(**{campo: valor for campo, valor in datos.items() if campo in CAMPOS_TAREA})
@@ -0,0 +1,332 @@
+import os
+import json
+import time
+import base64
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from task_record import TaskRecord
+
+# Estados en los que una tarea ya no cambia (una interrumpida solo cambia si se reanuda)
+ESTADOS_FINALES = ("completed", "error", "interrupted")
+ESTADOS_ACTIVOS = ("pending", "processing")
+
+# Campos de progreso que cambian con cada registro: se acumulan en memoria y se
+# escriben juntos con volcar(); cualquier otro campo (estado, mensaje, URLs) se
+# persiste en el momento
+CAMPOS_PROGRESO = frozenset((
+    "progress", "processed_records", "successful_records", "error_records",
+    "current_processing", "last_completed_row", "memory_samples",
+    "memory_peak_mb", "memory_avg_mb", "browser_recycles"
+))
+
+
+class TaskStore:
+    """
+    Almacén durable de tareas en SQLite (sobrevive reinicios en Render).
+    Columnas indexadas para búsquedas por task_id, estado, hash de archivo,
+    tipo, afiliador y fecha de creación; el resto del estado se guarda como JSON.
+    Las tareas activas se mantienen además en memoria para que las
+    actualizaciones frecuentes no relean la base; su progreso se escribe en
+    lote con volcar() (al reanudar, los contadores se recalculan del diario).
+    """
+
+    def __init__(self, db_path: str, ttl_seconds: float):
+        directorio = os.path.dirname(db_path)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.RLock()
+        self._activas: Dict[str, TaskRecord] = {}
+        # Tareas activas con progreso aún no escrito en la base
+        self._pendientes: set = set()
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                updated_ts REAL NOT NULL,
+                file_hash TEXT,
+                tipo_afiliacion TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status, updated_ts);
+            CREATE INDEX IF NOT EXISTS idx_tasks_hash ON tasks(file_hash, tipo_afiliacion);
+            CREATE TABLE IF NOT EXISTS task_inputs (
+                task_id TEXT PRIMARY KEY,
+                registros TEXT NOT NULL,
+                rechazados TEXT NOT NULL
+            );
+        """)
+        self._migrar()
+        # Índices secundarios para listar por página y filtrar sin recorrer toda la tabla
+        self._conn.executescript("""
+            CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks(created_ts, task_id);
+            CREATE INDEX IF NOT EXISTS idx_tasks_status_created ON tasks(status, created_ts, task_id);
+            CREATE INDEX IF NOT EXISTS idx_tasks_tipo_created ON tasks(tipo_afiliacion, created_ts, task_id);
+            CREATE INDEX IF NOT EXISTS idx_tasks_afiliador_created ON tasks(nombre_afiliador, created_ts, task_id);
+        """)
+        self._conn.commit()
+
+    def _migrar(self):
+        """Agregar columnas nuevas a bases creadas por versiones anteriores"""
+        columnas = {fila[1] for fila in self._conn.execute("PRAGMA table_info(tasks)")}
+        if "created_ts" not in columnas:
+            self._conn.execute("ALTER TABLE tasks ADD COLUMN created_ts REAL")
+            self._conn.execute("UPDATE tasks SET created_ts = updated_ts")
+        if "nombre_afiliador" not in columnas:
+            self._conn.execute("ALTER TABLE tasks ADD COLUMN nombre_afiliador TEXT")
+            self._conn.execute("UPDATE tasks SET nombre_afiliador = json_extract(data, '$.nombre_afiliador')")
+
+    # === ESCRITURA ===
+    def _guardar(self, task: TaskRecord):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO tasks "
+            "(task_id, status, updated_ts, created_ts, file_hash, tipo_afiliacion, nombre_afiliador, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                task.task_id,
+                task.status,
+                task.updated_ts,
+                task.created_ts,
+                task.file_hash,
+                task.tipo_afiliacion,
+                task.nombre_afiliador,
+                json.dumps(task.to_dict(), ensure_ascii=False, default=str)
+            )
+        )
+        self._conn.commit()
+        self._pendientes.discard(task.task_id)
+
+    def volcar(self) -> int:
+        """Escribir en una sola transacción el progreso acumulado de las tareas activas"""
+        with self._lock:
+            if not self._pendientes:
+                return 0
+            filas = [
+                (task.updated_ts, json.dumps(task.to_dict(), ensure_ascii=False, default=str), task.task_id)
+                for task in map(self._activas.get, self._pendientes) if task is not None
+            ]
+            self._conn.executemany("UPDATE tasks SET updated_ts = ?, data = ? WHERE task_id = ?", filas)
+            self._conn.commit()
+            self._pendientes.clear()
+            return len(filas)
+
+    def crear(self, task: TaskRecord):
+        """Registrar una tarea nueva"""
+        with self._lock:
+            self._guardar(task)
+            if task.status not in ESTADOS_FINALES:
+                self._activas[task.task_id] = task
+
+    def actualizar(self, task_id: str, **campos) -> bool:
+        """Actualizar campos de una tarea; retorna False si no existe"""
+        with self._lock:
+            task = self._activas.get(task_id) or self._leer(task_id)
+            if task is None:
+                return False
+
+            task.actualizar(**campos)
+            if task.status in ESTADOS_FINALES:
+                self._guardar(task)
+                self._activas.pop(task_id, None)
+                return True
+
+            self._activas[task_id] = task
+            if CAMPOS_PROGRESO.issuperset(campos):
+                self._pendientes.add(task_id)
+            else:
+                self._guardar(task)
+            return True
+
+    def registrar_resultado(self, task_id: str, estado: str, fila: Optional[int] = None) -> Optional[TaskRecord]:
+        """Sumar un registro terminado a los contadores de la tarea"""
+        with self._lock:
+            task = self._activas.get(task_id) or self._leer(task_id)
+            if task is None:
+                return None
+
+            task.registrar_resultado(estado, fila)
+            if task.status in ESTADOS_FINALES:
+                self._guardar(task)
+            else:
+                self._activas[task_id] = task
+                self._pendientes.add(task_id)
+            return task
+
+    def eliminar(self, task_id: str) -> Optional[TaskRecord]:
+        """Eliminar una tarea y retornar su último estado"""
+        with self._lock:
+            task = self.obtener(task_id)
+            if task is not None:
+                self._activas.pop(task_id, None)
+                self._pendientes.discard(task_id)
+                self._conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+                self._conn.execute("DELETE FROM task_inputs WHERE task_id = ?", (task_id,))
+                self._conn.commit()
+            return task
+
+    # === ENTRADA DE LA TAREA (para reanudar) ===
+    def guardar_entrada(self, task_id: str, registros: List[Dict], rechazados: List[Dict]):
+        """Persistir los registros de la tarea para poder reanudarla tras un reinicio"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO task_inputs (task_id, registros, rechazados) VALUES (?, ?, ?)",
+                (
+                    task_id,
+                    json.dumps(registros, ensure_ascii=False, default=str),
+                    json.dumps(rechazados, ensure_ascii=False, default=str)
+                )
+            )
+            self._conn.commit()
+
+    def obtener_entrada(self, task_id: str) -> Optional[Tuple[List[Dict], List[Dict]]]:
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT registros, rechazados FROM task_inputs WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        return (json.loads(fila[0]), json.loads(fila[1])) if fila else None
+
+    def eliminar_entrada(self, task_id: str):
+        """Descartar la entrada cuando la tarea ya no se puede reanudar (completada)"""
+        with self._lock:
+            self._conn.execute("DELETE FROM task_inputs WHERE task_id = ?", (task_id,))
+            self._conn.commit()
+
+    # === LECTURA ===
+    def _leer(self, task_id: str) -> Optional[TaskRecord]:
+        fila = self._conn.execute("SELECT data FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return TaskRecord.from_dict(json.loads(fila[0])) if fila else None
+
+    def obtener(self, task_id: str) -> Optional[TaskRecord]:
+        """Estado actual de una tarea (memoria para activas, índice por task_id para el resto)"""
+        with self._lock:
+            task = self._activas.get(task_id)
+            return task if task is not None else self._leer(task_id)
+
+    def __contains__(self, task_id: str) -> bool:
+        return self.obtener(task_id) is not None
+
+    def listar(
+        self,
+        limite: int = 50,
+        cursor: Optional[str] = None,
+        status: Optional[str] = None,
+        tipo_afiliacion: Optional[str] = None,
+        nombre_afiliador: Optional[str] = None,
+        desde: Optional[float] = None,
+        hasta: Optional[float] = None
+    ) -> Tuple[List[TaskRecord], Optional[str]]:
+        """
+        Página de tareas (más recientes primero) con filtros opcionales.
+        Paginación por cursor sobre (created_ts, task_id): el costo depende
+        del tamaño de página, no del total de tareas.
+        Retorna (tareas, siguiente_cursor)
+        """
+        condiciones = []
+        parametros: list = []
+
+        for columna, valor in (
+            ("status", status),
+            ("tipo_afiliacion", tipo_afiliacion),
+            ("nombre_afiliador", nombre_afiliador)
+        ):
+            if valor is not None:
+                condiciones.append(f"{columna} = ?")
+                parametros.append(valor)
+
+        if desde is not None:
+            condiciones.append("created_ts >= ?")
+            parametros.append(desde)
+        if hasta is not None:
+            condiciones.append("created_ts < ?")
+            parametros.append(hasta)
+
+        if cursor:
+            cursor_ts, cursor_id = _decodificar_cursor(cursor)
+            condiciones.append("(created_ts < ? OR (created_ts = ? AND task_id < ?))")
+            parametros.extend([cursor_ts, cursor_ts, cursor_id])
+
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        with self._lock:
+            filas = self._conn.execute(
+                f"SELECT task_id, created_ts, data FROM tasks {where} "
+                f"ORDER BY created_ts DESC, task_id DESC LIMIT ?",
+                (*parametros, limite + 1)
+            ).fetchall()
+            tareas = [
+                self._activas.get(task_id) or TaskRecord.from_dict(json.loads(data))
+                for task_id, _, data in filas[:limite]
+            ]
+
+        siguiente = None
+        if len(filas) > limite:
+            ultimo_id, ultimo_ts, _ = filas[limite - 1]
+            siguiente = _codificar_cursor(ultimo_ts, ultimo_id)
+        return tareas, siguiente
+
+    def contar_por_estado(self) -> Dict[str, int]:
+        """Cantidad de tareas por estado (usa el índice de estado)"""
+        with self._lock:
+            filas = self._conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+            return dict(filas)
+
+    def buscar_activa_por_hash(self, file_hash: str, tipo_afiliacion: str) -> Optional[str]:
+        """task_id de una tarea pendiente/en proceso para el mismo archivo y tipo"""
+        with self._lock:
+            fila = self._conn.execute(
+                f"SELECT task_id FROM tasks WHERE file_hash = ? AND tipo_afiliacion = ? "
+                f"AND status IN ({','.join('?' * len(ESTADOS_ACTIVOS))}) LIMIT 1",
+                (file_hash, tipo_afiliacion, *ESTADOS_ACTIVOS)
+            ).fetchone()
+            return fila[0] if fila else None
+
+    # === MANTENIMIENTO ===
+    def expirar(self) -> List[str]:
+        """Eliminar tareas terminadas más antiguas que el TTL; retorna sus task_id"""
+        limite = time.time() - self.ttl_seconds
+        condicion = f"status IN ({','.join('?' * len(ESTADOS_FINALES))}) AND updated_ts < ?"
+        with self._lock:
+            filas = self._conn.execute(
+                f"SELECT task_id FROM tasks WHERE {condicion}", (*ESTADOS_FINALES, limite)
+            ).fetchall()
+            self._conn.execute(f"DELETE FROM tasks WHERE {condicion}", (*ESTADOS_FINALES, limite))
+            self._conn.execute("DELETE FROM task_inputs WHERE task_id NOT IN (SELECT task_id FROM tasks)")
+            self._conn.commit()
+            return [fila[0] for fila in filas]
+
+    def marcar_interrumpidas(self, mensaje: str) -> List[str]:
+        """Al iniciar: las tareas que quedaron activas se detuvieron con el proceso anterior"""
+        with self._lock:
+            filas = self._conn.execute(
+                f"SELECT task_id FROM tasks WHERE status IN ({','.join('?' * len(ESTADOS_ACTIVOS))})",
+                ESTADOS_ACTIVOS
+            ).fetchall()
+            ids = [fila[0] for fila in filas]
+            for task_id in ids:
+                self.actualizar(task_id, status="interrupted", message=mensaje)
+            return ids
+
+    def close(self):
+        with self._lock:
+            self.volcar()
+            self._conn.close()
+
+
+# === UTILIDADES ===
+def _codificar_cursor(created_ts: float, task_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{created_ts!r}|{task_id}".encode()).decode().rstrip("=")
+
+
+def _decodificar_cursor(cursor: str) -> Tuple[float, str]:
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        created_ts, task_id = base64.urlsafe_b64decode(cursor + relleno).decode().split("|", 1)
+        return float(created_ts), task_id
+    except Exception:
+        raise ValueError("Cursor inválido")
@@ -0,0 +1,100 @@
+import os
+import gzip
+import json
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# Cambiar cuando cambie la lógica de lectura/validación para invalidar entradas viejas
+CACHE_VERSION = 1
+
+CAMPOS_REGISTRO = ["reserva", "nombre", "correo", "fila"]
+CAMPOS_RECHAZO = CAMPOS_REGISTRO + ["motivo"]
+
+
+def _a_columnas(filas: List[Dict], campos: List[str]) -> Dict[str, list]:
+    """Formato columnar: los nombres de campo se guardan una sola vez"""
+    return {campo: [fila[campo] for fila in filas] for campo in campos}
+
+
+def _a_filas(columnas: Dict[str, list], campos: List[str]) -> List[Dict]:
+    return [dict(zip(campos, valores)) for valores in zip(*(columnas[c] for c in campos))]
+
+
+class CacheUploads:
+    """
+    Cache en disco de uploads ya leídos, indexado por el hash del contenido.
+    Guarda los registros normalizados como JSON columnar comprimido (gzip)
+    y expulsa las entradas menos usadas (LRU por mtime) al superar el tamaño máximo.
+    """
+
+    def __init__(self, directorio: str, max_bytes: int):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directorio, exist_ok=True)
+
+    def _ruta(self, file_hash: str) -> str:
+        return os.path.join(self.directorio, f"{file_hash}.v{CACHE_VERSION}.json.gz")
+
+    def obtener(self, file_hash: str) -> Optional[Tuple[List[Dict], List[Dict]]]:
+        """Retornar (registros, rechazados) si el archivo ya fue leído antes"""
+        ruta = self._ruta(file_hash)
+        try:
+            with gzip.open(ruta, "rt", encoding="utf-8") as f:
+                datos = json.load(f)
+            # Marcar como usado recientemente
+            os.utime(ruta, None)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"[⚠️] Entrada de cache corrupta {ruta}: {e}")
+            self._eliminar(ruta)
+            return None
+
+        return (
+            _a_filas(datos["registros"], CAMPOS_REGISTRO),
+            _a_filas(datos["rechazados"], CAMPOS_RECHAZO)
+        )
+
+    def guardar(self, file_hash: str, registros: List[Dict], rechazados: List[Dict]):
+        """Guardar el resultado de la lectura y aplicar la expulsión LRU"""
+        ruta = self._ruta(file_hash)
+        datos = {
+            "registros": _a_columnas(registros, CAMPOS_REGISTRO),
+            "rechazados": _a_columnas(rechazados, CAMPOS_RECHAZO)
+        }
+
+        tmp_ruta = f"{ruta}.tmp"
+        with gzip.open(tmp_ruta, "wt", encoding="utf-8", compresslevel=6) as f:
+            json.dump(datos, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_ruta, ruta)
+
+        self._expulsar()
+
+    def _expulsar(self):
+        """Eliminar las entradas más antiguas hasta quedar bajo el límite"""
+        with self._lock:
+            entradas = []
+            for nombre in os.listdir(self.directorio):
+                if not nombre.endswith(".json.gz"):
+                    continue
+                ruta = os.path.join(self.directorio, nombre)
+                try:
+                    stat = os.stat(ruta)
+                except FileNotFoundError:
+                    continue
+                entradas.append((stat.st_mtime, stat.st_size, ruta))
+
+            total = sum(size for _, size, _ in entradas)
+            for _, size, ruta in sorted(entradas):
+                if total <= self.max_bytes:
+                    break
+                self._eliminar(ruta)
+                total -= size
+
+    @staticmethod
+    def _eliminar(ruta: str):
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass